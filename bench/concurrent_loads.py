@@ -0,0 +1,78 @@
+"""Wall-clock comparison of sequential and concurrent data loading for the panel pages
+
+Runs the dashboard's two loads (stats and the latest appeals) and the appeals list (rows and
+count) both one after another and with asyncio.gather on separate pooled connections:
+
+    python bench/concurrent_loads.py --rounds 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import db
+from db.instrument import close_pool
+
+
+async def dashboard_sequential():
+    await db.get_appeals_stats()
+    await db.get_appeals(limit=10)
+
+
+async def dashboard_concurrent():
+    await asyncio.gather(db.get_appeals_stats(), db.get_appeals(limit=10))
+
+
+async def appeals_sequential():
+    where_clause, params = db._appeal_filters(status='done')
+    await db._fetch('fetch', f"SELECT * FROM appeals {where_clause} ORDER BY created_at DESC LIMIT 20 OFFSET 0", *params)
+    await db._fetch('fetchval', f"SELECT COUNT(*) FROM appeals {where_clause}", *params)
+
+
+async def appeals_concurrent():
+    await db.get_appeals(status='done', limit=20)
+
+
+CASES = {
+    'dashboard': (dashboard_sequential, dashboard_concurrent),
+    'appeals_page': (appeals_sequential, appeals_concurrent),
+}
+
+
+async def measure(call, rounds, warmup):
+    for _ in range(warmup):
+        await call()
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {'p50_ms': round(statistics.median(timings), 3), 'mean_ms': round(statistics.mean(timings), 3)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    try:
+        for name, (sequential, concurrent) in CASES.items():
+            before = await measure(sequential, args.rounds, args.warmup)
+            after = await measure(concurrent, args.rounds, args.warmup)
+            results[name] = {
+                'sequential': before,
+                'concurrent': after,
+                'reduction': f"{1 - after['p50_ms'] / before['p50_ms']:.0%}" if before['p50_ms'] else None,
+            }
+    finally:
+        await close_pool()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
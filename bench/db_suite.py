@@ -0,0 +1,240 @@
+"""Benchmark suite for the query functions in db/db.py
+
+Runs each public read path (and, with --reseed, bulk_update_status) a number of rounds and records per case:
+latency percentiles, pooled connections used, round trips (queries sent), and for every distinct
+query its EXPLAIN (ANALYZE, BUFFERS) execution time, rows scanned and buffer hits/reads.
+Results are written as JSON so runs from different commits can be diffed:
+
+    python bench/db_suite.py                              # current database, as is
+    python bench/db_suite.py --sizes 10000,100000,1000000 --reseed
+    python bench/db_suite.py --compare bench/results/<old>.json
+
+--reseed TRUNCATEs appeals, messages and pending_admin_messages and refills them with
+db.seed for every size; only point it at a scratch database. Cases that write (WRITE_CASES)
+only run then, since their timed calls commit.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+import asyncpg
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DB_URL
+from db import db
+from db import seed
+from db.instrument import track_unit, close_pool
+
+SCAN_NODES = ('Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan')
+# Only run on reseeded data: the db.db functions commit on their own connections, so only the EXPLAIN is rolled back
+WRITE_CASES = ('bulk_update_status',)
+
+
+def scanned(plan):
+    """Rows read by scan nodes (returned plus filtered out) across an EXPLAIN (FORMAT JSON) plan tree"""
+    rows = 0
+    if plan['Node Type'] in SCAN_NODES:
+        rows = (plan.get('Actual Rows', 0) + plan.get('Rows Removed by Filter', 0)) * plan.get('Actual Loops', 1)
+    for child in plan.get('Plans', []):
+        rows += scanned(child)
+    return rows
+
+
+async def explain(conn, query, args):
+    # Writes are explained inside a transaction that is rolled back
+    tx = conn.transaction()
+    await tx.start()
+    try:
+        result = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *(args or ()))
+    finally:
+        await tx.rollback()
+    plan = json.loads(result)[0]
+    root = plan['Plan']
+    return {
+        'query': ' '.join(query.split())[:200],
+        'execution_ms': round(plan['Execution Time'], 3),
+        'planning_ms': round(plan['Planning Time'], 3),
+        'rows_scanned': scanned(root),
+        'rows_returned': root.get('Actual Rows', 0),
+        'shared_hit_blocks': root.get('Shared Hit Blocks', 0),
+        'shared_read_blocks': root.get('Shared Read Blocks', 0),
+    }
+
+
+async def sample(conn):
+    """Real ids and values from the dataset for parameterised cases"""
+    appeal = await conn.fetchrow("""
+        SELECT a.id, a.user_id, a.room FROM appeals a
+        JOIN messages m ON m.appeal_id = a.id
+        GROUP BY a.id ORDER BY COUNT(*) DESC LIMIT 1
+    """) or await conn.fetchrow("SELECT id, user_id, room FROM appeals ORDER BY id DESC LIMIT 1")
+    done_ids = await conn.fetchval("SELECT array_agg(id) FROM (SELECT id FROM appeals WHERE status='done' ORDER BY id DESC LIMIT 200) t")
+    return {
+        'appeal_id': appeal['id'] if appeal else 0,
+        'user_id': appeal['user_id'] if appeal else 0,
+        'room': appeal['room'] if appeal else '101',
+        'done_ids': done_ids or [],
+    }
+
+
+def cases(s):
+    return {
+        'get_appeals': lambda: db.get_appeals(),
+        'get_appeals[status]': lambda: db.get_appeals(status='new'),
+        'get_appeals[room]': lambda: db.get_appeals(room=s['room']),
+        'get_appeals[request_type]': lambda: db.get_appeals(request_type='technical_wifi'),
+        'get_appeals[search]': lambda: db.get_appeals(search_query='кондиционер'),
+        'get_appeals[offset=1000]': lambda: db.get_appeals(offset=1000),
+        'get_appeals_stats': lambda: db.get_appeals_stats(),
+        'get_appeals_by_type': lambda: db.get_appeals_by_type(),
+        'get_appeal_with_messages': lambda: db.get_appeal_with_messages(s['appeal_id']),
+        'can_user_reply': lambda: db.can_user_reply(s['appeal_id'], s['user_id']),
+        # Sets 'done' on appeals that are already done; still bumps their updated_at, hence WRITE_CASES
+        'bulk_update_status': lambda: db.bulk_update_status(s['done_ids'], 'done'),
+        'get_message_template': lambda: db.get_message_template('status_done'),
+        'get_all_message_templates': lambda: db.get_all_message_templates(),
+        'get_setting': lambda: db.get_setting('timezone'),
+        'get_all_settings': lambda: db.get_all_settings(),
+        'get_notification_recipients': lambda: db.get_notification_recipients(),
+    }
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+async def run_case(conn, name, call, rounds, warmup):
+    for _ in range(warmup):
+        await call()
+
+    latencies = []
+    for _ in range(rounds):
+        async with track_unit('bench', name, keep_statements=True) as unit:
+            started = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    # Statements and connections of the last round
+    queries = unit.statements
+    connections = unit.connections
+    plans = []
+    seen = set()
+    for query, args in queries:
+        if query in seen:
+            continue
+        seen.add(query)
+        plans.append(await explain(conn, query, args))
+
+    return {
+        'rounds': rounds,
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'min_ms': round(min(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'connections': connections,
+        'round_trips': len(queries),
+        'rows_scanned': sum(plan['rows_scanned'] for plan in plans),
+        'queries': plans,
+    }
+
+
+async def reseed(conn, size, batch):
+    await conn.execute("TRUNCATE appeals, messages, pending_admin_messages RESTART IDENTITY CASCADE")
+    args = argparse.Namespace(
+        appeals=size, batch=batch, seed=42, days=365, messages_per_appeal=1.5, outbox_ratio=0.8,
+        until=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    )
+    await seed.generate(conn, args)
+    for table in ('appeals', 'messages', 'pending_admin_messages'):
+        await conn.execute(f"ANALYZE {table}")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline['commit']} ({baseline_path}), threshold {threshold:.0%}:")
+    for size, results in current['sizes'].items():
+        for name, result in results.items():
+            old = baseline['sizes'].get(size, {}).get(name)
+            if not old:
+                continue
+            change = result['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] else 0
+            flag = 'REGRESSION' if change > threshold else 'improved' if change < -threshold else ''
+            print(f"  [{size}] {name:32} p50 {old['p50_ms']:9.2f} -> {result['p50_ms']:9.2f} ms ({change:+.0%})"
+                  f"  round trips {old['round_trips']} -> {result['round_trips']}"
+                  f"  rows scanned {old['rows_scanned']} -> {result['rows_scanned']}  {flag}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='', help='comma-separated appeal counts to seed (requires --reseed)')
+    parser.add_argument('--reseed', action='store_true', help='truncate and reseed the tables for every size')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', default='', help='comma-separated case names to run')
+    parser.add_argument('--batch', type=int, default=10000, help='rows per COPY when reseeding')
+    parser.add_argument('--output', default=None, help='result file (default: bench/results/<commit>-<time>.json)')
+    parser.add_argument('--compare', default=None, help='earlier result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative p50 change reported as a regression')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size] if args.reseed else [None]
+    if args.reseed and not sizes:
+        parser.error('--reseed needs --sizes')
+
+    await db.init_db()
+    conn = await asyncpg.connect(DB_URL)
+    result = {'commit': git_commit(), 'timestamp': datetime.now().isoformat(), 'sizes': {}}
+    try:
+        for size in sizes:
+            if size is not None:
+                print(f"Seeding {size} appeals...")
+                await reseed(conn, size, args.batch)
+            actual = await conn.fetchval("SELECT COUNT(*) FROM appeals")
+            label = str(size if size is not None else actual)
+            print(f"\n{label} appeals")
+
+            results = {}
+            selected = set(filter(None, args.only.split(',')))
+            for name, call in cases(await sample(conn)).items():
+                if selected and name not in selected:
+                    continue
+                if name in WRITE_CASES and not args.reseed:
+                    print(f"  {name:32} skipped: writes to the database, runs only with --reseed")
+                    continue
+                results[name] = await run_case(conn, name, call, args.rounds, args.warmup)
+                r = results[name]
+                print(f"  {name:32} p50 {r['p50_ms']:9.2f} ms  p95 {r['p95_ms']:9.2f} ms  "
+                      f"conns {r['connections']}  round trips {r['round_trips']}  rows scanned {r['rows_scanned']}")
+            result['sizes'][label] = results
+    finally:
+        await conn.close()
+        await close_pool()
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'results',
+        f"{result['commit']}-{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(result, args.compare, args.threshold)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""Latency benchmark for POST /api/appeals/{id}/status
+
+Run it against a running admin panel before and after a change and compare the percentiles:
+
+    python bench/status_update.py --url http://localhost:8000 --appeal-id 1 --requests 500 --concurrency 10
+
+Statuses are cycled so every request is a real change, and the Redis duplicate-click guard is
+sidestepped by spreading requests over --appeal-id .. --appeal-id + --appeals - 1. A non-zero
+skipped_as_duplicate in the output means --appeals is too small for the request rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+import aiohttp
+
+STATUSES = ('received', 'done', 'declined', 'new')
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run(args):
+    auth = aiohttp.BasicAuth(args.user, args.password)
+    latencies = []
+    errors = 0
+    skipped = 0
+    counter = iter(range(args.requests))
+
+    async with aiohttp.ClientSession(auth=auth) as session:
+        async def worker():
+            nonlocal errors, skipped
+            for i in counter:
+                appeal_id = args.appeal_id + i % args.appeals
+                status = STATUSES[(i // args.appeals) % len(STATUSES)]
+                started = time.perf_counter()
+                async with session.post(f"{args.url}/api/appeals/{appeal_id}/status", data={'status': status}) as response:
+                    body = await response.read()
+                    if response.status != 200:
+                        errors += 1
+                    elif json.loads(body).get('skipped'):
+                        skipped += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'skipped_as_duplicate': skipped,
+        'concurrency': args.concurrency,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies), 2),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2),
+    }
+    print(json.dumps(result, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default=os.getenv('ADMIN_PASSWORD', 'admin123'))
+    parser.add_argument('--appeal-id', type=int, default=1, help='first appeal id to update')
+    parser.add_argument('--appeals', type=int, default=50, help='number of consecutive appeal ids to spread requests over')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import time
+from redis.exceptions import ResponseError
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db.db import (
+    assign_appeal_to_admin, get_all_admins, get_all_settings, get_appeal_summary, get_open_assignments
+)
+from db.streams import APPEAL_EVENTS_STREAM
+
+logger = logging.getLogger(__name__)
+
+# Open (new or received) appeals per admin user_id
+ASSIGN_LOAD_KEY = 'assign:load'
+# Admin of every open assigned appeal, so a status change knows whose counter to lower
+ASSIGN_OWNER_KEY = 'assign:owner'
+# Round-robin position per request type
+ASSIGN_CURSOR_KEY = 'assign:rr:{request_type}'
+ASSIGN_GROUP = 'assign'
+
+OPEN_STATUSES = ('new', 'received')
+POLICIES = ('least_loaded', 'round_robin', 'off')
+DEFAULT_POLICY = 'least_loaded'
+# Only admins with this role get appeals routed to them
+ASSIGNABLE_ROLE = 'admin'
+EVENT_BATCH = 100
+BLOCK_MS = 5000
+REFRESH_INTERVAL = 60
+
+
+class AssignmentEngine:
+    """Routes every new appeal to an admin by the policy of its request type
+
+    Policies come from settings (assign_policy_<request_type>, falling back to assign_policy_default):
+    least_loaded picks the admin with the fewest open appeals, round_robin takes turns, off leaves the
+    appeal unassigned. Load counters live in Redis and are only adjusted by status events from the
+    appeal event log, so picking an admin never needs an aggregate query.
+    """
+
+    def __init__(self):
+        self.redis = None
+        self.consumer = f"bot-{os.getpid()}"
+        self.admins = []
+        self.policies = {}
+        self.loaded_at = 0.0
+
+    async def refresh(self, force=False):
+        if not force and time.monotonic() - self.loaded_at < REFRESH_INTERVAL:
+            return
+        admins, settings = await asyncio.gather(get_all_admins(), get_all_settings())
+        self.admins = [admin for admin in admins if admin['role'] == ASSIGNABLE_ROLE]
+        self.policies = {row['key']: row['value'] for row in settings if row['key'].startswith('assign_policy_')}
+        self.loaded_at = time.monotonic()
+
+    def policy(self, request_type):
+        for key in (f"assign_policy_{request_type}", 'assign_policy_default'):
+            if self.policies.get(key) in POLICIES:
+                return self.policies[key]
+        return DEFAULT_POLICY
+
+    async def pick(self, request_type):
+        if not self.admins:
+            return None
+        policy = self.policy(request_type)
+        if policy == 'off':
+            return None
+        cursor = await self.redis.incr(ASSIGN_CURSOR_KEY.format(request_type=request_type))
+        if policy == 'round_robin':
+            return self.admins[cursor % len(self.admins)]
+        loads = await self.redis.hmget(ASSIGN_LOAD_KEY, [admin['user_id'] for admin in self.admins])
+        # Ties are broken by the round-robin cursor so equally loaded admins take turns
+        offset = cursor % len(self.admins)
+        order = self.admins[offset:] + self.admins[:offset]
+        counts = dict(zip((admin['user_id'] for admin in self.admins), (int(load or 0) for load in loads)))
+        return min(order, key=lambda admin: counts[admin['user_id']])
+
+    async def assign(self, appeal_id, request_type):
+        """Assign a freshly created appeal; returns the admin row or None when nobody was picked"""
+        if not self.redis:
+            return None
+        try:
+            await self.refresh()
+            admin = await self.pick(request_type)
+            if not admin:
+                return None
+            await assign_appeal_to_admin(appeal_id, admin['user_id'])
+            await self.track(appeal_id, admin['user_id'])
+            logger.info(f"Appeal #{appeal_id} assigned to admin {admin['user_id']} ({self.policy(request_type)})")
+            return admin
+        except Exception as e:
+            logger.error(f"Could not assign appeal #{appeal_id}: {e}")
+            return None
+
+    async def track(self, appeal_id, admin_id):
+        if await self.redis.hsetnx(ASSIGN_OWNER_KEY, appeal_id, admin_id):
+            await self.redis.hincrby(ASSIGN_LOAD_KEY, admin_id, 1)
+
+    async def release(self, appeal_id):
+        admin_id = await self.redis.hget(ASSIGN_OWNER_KEY, appeal_id)
+        # HDEL succeeds once per appeal, so repeated events never lower a counter twice
+        if admin_id is not None and await self.redis.hdel(ASSIGN_OWNER_KEY, appeal_id):
+            await self.redis.hincrby(ASSIGN_LOAD_KEY, int(admin_id), -1)
+
+    async def rebuild(self):
+        """Recount open assigned appeals from the database; only done at startup"""
+        rows = await get_open_assignments(OPEN_STATUSES)
+        loads = {}
+        for row in rows:
+            loads[row['assigned_admin']] = loads.get(row['assigned_admin'], 0) + 1
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(ASSIGN_LOAD_KEY, ASSIGN_OWNER_KEY)
+            if loads:
+                pipe.hset(ASSIGN_LOAD_KEY, mapping=loads)
+                pipe.hset(ASSIGN_OWNER_KEY, mapping={row['id']: row['assigned_admin'] for row in rows})
+            await pipe.execute()
+        logger.info(f"Assignment load rebuilt: {len(rows)} open appeals across {len(loads)} admins")
+
+    async def ensure_group(self):
+        try:
+            await self.redis.xgroup_create(APPEAL_EVENTS_STREAM, ASSIGN_GROUP, id='$', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def apply_event(self, event):
+        event_type = event.get('type')
+        if event_type == 'status_update':
+            appeal_ids = [event['appeal_id']]
+        elif event_type == 'bulk_update' and event.get('appeal_ids'):
+            appeal_ids = event['appeal_ids']
+        else:
+            return
+        for appeal_id in appeal_ids:
+            if event.get('status') not in OPEN_STATUSES:
+                await self.release(appeal_id)
+            elif not await self.redis.hexists(ASSIGN_OWNER_KEY, appeal_id):
+                # Reopened (to 'new' or straight to 'received'): the appeal counts against its admin again
+                appeal = await get_appeal_summary(appeal_id)
+                if appeal and appeal['assigned_admin']:
+                    await self.track(appeal_id, appeal['assigned_admin'])
+
+    async def read_events(self):
+        response = await self.redis.xreadgroup(
+            ASSIGN_GROUP, self.consumer, {APPEAL_EVENTS_STREAM: '>'}, count=EVENT_BATCH, block=BLOCK_MS
+        )
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                try:
+                    await self.apply_event(json.loads(fields[b'data']))
+                except Exception as e:
+                    logger.error(f"Could not apply appeal event {entry_id} to assignment load: {e}")
+                await self.redis.xack(APPEAL_EVENTS_STREAM, ASSIGN_GROUP, entry_id)
+
+    async def run(self, redis_client):
+        self.redis = redis_client
+        while True:
+            try:
+                await self.refresh(force=True)
+                # Group first: status changes made while rebuilding are applied afterwards, not lost
+                await self.ensure_group()
+                await self.rebuild()
+                break
+            except Exception as e:
+                logger.error(f"Assignment engine could not start: {e}")
+                await asyncio.sleep(5)
+
+        while True:
+            try:
+                await self.read_events()
+            except asyncio.CancelledError:
+                raise
+            except ResponseError as e:
+                if 'NOGROUP' in str(e):
+                    await self.ensure_group()
+                else:
+                    logger.error(f"Assignment engine error: {e}")
+                    await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"Assignment engine error: {e}")
+                await asyncio.sleep(1)
+
+
+assignment_engine = AssignmentEngine()
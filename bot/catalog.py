@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, Optional
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db.db import get_service_catalog, get_service_catalog_version, get_all_message_templates
+
+logger = logging.getLogger(__name__)
+
+ROOT_MENU = 'main'
+
+EMPTY = MappingProxyType({})
+
+
+@dataclass(frozen=True)
+class ServiceEntry:
+    key: str
+    kind: str
+    request_type: Optional[str]
+    label: str
+
+
+@dataclass(frozen=True)
+class Menu:
+    title: str
+    keyboard: InlineKeyboardMarkup
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Immutable set of prebuilt menus; replaced as a whole on every rebuild"""
+    version: tuple = ()
+    menus: Mapping[str, Menu] = field(default=EMPTY)
+    requests: Mapping[str, ServiceEntry] = field(default=EMPTY)
+    type_labels: Mapping[str, str] = field(default=EMPTY)
+    templates: Mapping[str, str] = field(default=EMPTY)
+    comment_prompt: Optional[Menu] = None
+    contacts_keyboard: Optional[InlineKeyboardMarkup] = None
+    back_keyboard: Optional[InlineKeyboardMarkup] = None
+
+    def text(self, key, default):
+        return self.templates.get(key) or default
+
+
+def _keyboard(rows) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=data) for text, data in row]
+        for row in rows
+    ])
+
+
+def build_snapshot(version, catalog_rows, template_rows) -> CatalogSnapshot:
+    templates = {row['key']: row['text'] for row in template_rows}
+
+    def label_of(row):
+        return (row['label_key'] and templates.get(row['label_key'])) or row['label'] or row['key']
+
+    menu_rows = {}
+    titles = {}
+    requests = {}
+    type_labels = {}
+    for row in catalog_rows:
+        if row['kind'] == 'menu':
+            titles[row['key']] = (row['title_key'] and templates.get(row['title_key'])) or row['title'] or ''
+        if row['kind'] == 'request':
+            entry = ServiceEntry(row['key'], row['kind'], row['request_type'], label_of(row))
+            requests[row['key']] = entry
+        if row['request_type']:
+            type_labels.setdefault(row['request_type'], label_of(row))
+        if row['parent']:
+            rows = menu_rows.setdefault(row['parent'], {})
+            rows.setdefault(row['row_num'], []).append((label_of(row), row['key']))
+
+    menus = {}
+    for key, title in titles.items():
+        rows = menu_rows.get(key, {})
+        menus[key] = Menu(title, _keyboard(rows[num] for num in sorted(rows)))
+
+    comment_prompt = Menu(
+        templates.get('comment_question') or "Хотите добавить комментарий к заявке?",
+        _keyboard([
+            [(templates.get('add_comment') or "💬 Добавить комментарий", "add_comment")],
+            [(templates.get('send_no_comment') or "✅ Отправить без комментария", "send_no_comment")],
+        ])
+    )
+
+    return CatalogSnapshot(
+        version=version,
+        menus=MappingProxyType(menus),
+        requests=MappingProxyType(requests),
+        type_labels=MappingProxyType(type_labels),
+        templates=MappingProxyType(templates),
+        comment_prompt=comment_prompt,
+        contacts_keyboard=_keyboard([[("🔙 Назад к услугам", "back_services")]]),
+        back_keyboard=_keyboard([[(templates.get('back_services') or "🔙 Назад к услугам", "back_services")]]),
+    )
+
+
+class ServiceCatalog:
+    """Service menus loaded once at startup and rebuilt only when the catalog or templates change"""
+
+    def __init__(self):
+        self.snapshot = CatalogSnapshot()
+
+    async def load(self):
+        version = await get_service_catalog_version()
+        catalog_rows = await get_service_catalog()
+        template_rows = await get_all_message_templates()
+        self.snapshot = build_snapshot(version, catalog_rows, template_rows)
+        logger.info(f"Service catalog loaded: {len(self.snapshot.menus)} menus, {len(self.snapshot.requests)} request types")
+
+    async def refresh(self):
+        version = await get_service_catalog_version()
+        if version != self.snapshot.version:
+            await self.load()
+
+    async def watch(self, interval=30):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing service catalog: {e}")
+
+    def is_request(self, data) -> bool:
+        return data in self.snapshot.requests
+
+    def is_menu(self, data) -> bool:
+        return data != ROOT_MENU and data in self.snapshot.menus
+
+    def menu(self, key) -> Optional[Menu]:
+        return self.snapshot.menus.get(key)
+
+    def type_label(self, request_type) -> Optional[str]:
+        return self.snapshot.type_labels.get(request_type)
+
+
+service_catalog = ServiceCatalog()
@@ -1,26 +1,65 @@
 import asyncio
 import logging
-import asyncpg
+import redis.asyncio as redis
 from datetime import datetime
 from aiogram import Bot, Dispatcher, Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, FSInputFile
+from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, FSInputFile
 from aiogram.filters import Command, CommandObject
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import TOKEN, DB_URL
-from db.db import create_appeal, add_message, init_db, get_notification_recipients, get_message_template, init_message_templates, get_current_time_in_timezone, format_time_for_display, init_settings
+from config import TOKEN, REDIS_URL
+from db.db import create_appeal, add_message, change_status, get_notification_recipients, get_all_admins, get_message_template, get_current_time_in_timezone, format_time_for_display
+from db.streams import publish_admin_event, ADMIN_EVENTS_CHANNEL, ADMIN_NOTIFICATIONS_CHANNEL, status_change, stats_delta_event, invalidate_cached
+from db.instrument import connect, track_unit
+from db.metrics import start_metrics_server
+from bot.catalog import service_catalog, ROOT_MENU
+from bot.sla import sla_escalator
+from bot.assignment import assignment_engine
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', '8082'))
+
 bot = Bot(TOKEN)
 dp = Dispatcher()
 router = Router()
 dp.include_router(router)
 
+redis_client = None
+
+
+async def init_redis():
+    global redis_client
+    try:
+        redis_client = redis.from_url(REDIS_URL)
+        await redis_client.ping()
+        logger.info("Redis connection established")
+    except Exception as e:
+        logger.error(f"Redis connection failed, admin panel live updates disabled: {e}")
+        redis_client = None
+
+
+async def publish_event(event, channel=ADMIN_EVENTS_CHANNEL):
+    if not redis_client:
+        return
+    try:
+        await publish_admin_event(redis_client, event, channel)
+    except Exception as e:
+        logger.error(f"Failed to publish admin event: {e}")
+
+
+async def invalidate_panel_cache():
+    if not redis_client:
+        return
+    try:
+        await invalidate_cached(redis_client, 'appeals')
+    except Exception as e:
+        logger.error(f"Failed to invalidate admin panel cache: {e}")
+
 
 class RoomInput(StatesGroup):
     waiting_room = State()
@@ -40,22 +79,8 @@ async def show_main_menu(message: Message):
 
 
 async def show_service_menu(message: Message, state: FSMContext):
-    service_iron_text = await get_message_template('service_iron') or "🧹 Нужен утюг и гладильная доска"
-    service_laundry_text = await get_message_template('service_laundry') or "👕 Услуги прачечной"
-    service_other_text = await get_message_template('service_other') or "❓ Другой вопрос"
-    contacts_text = await get_message_template('menu_contacts') or "📞 Контакты"
-    back_main_menu_text = await get_message_template('back_main_menu') or "🏠 Назад в главное меню"
-    service_menu_title = await get_message_template('service_menu_title') or "Выберите услугу:"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=service_iron_text, callback_data="service_iron")],
-        [InlineKeyboardButton(text=service_laundry_text, callback_data="service_laundry")],
-        [InlineKeyboardButton(text="🔧 Техническая проблема в номере", callback_data="service_technical")],
-        [InlineKeyboardButton(text="🍽 Услуги ресторана", callback_data="service_restaurant")],
-        [InlineKeyboardButton(text=service_other_text, callback_data="service_other")],
-        [InlineKeyboardButton(text=contacts_text, callback_data="menu_contacts"), InlineKeyboardButton(text=back_main_menu_text, callback_data="back_main_menu")]
-    ])
-    await message.answer(service_menu_title, reply_markup=keyboard)
+    menu = service_catalog.menu(ROOT_MENU)
+    await message.answer(menu.title, reply_markup=menu.keyboard)
 
 
 @router.message(Command("start"))
@@ -133,10 +158,7 @@ async def menu_contacts(callback: CallbackQuery, state: FSMContext):
 🌐 Сайт: hotel-spasskaya.ru
 📧 Почта: info@hotel-spasskaya.ru
 """
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Назад к услугам", callback_data="back_services")]
-    ])
-    await callback.message.answer(contacts_text, reply_markup=keyboard)
+    await callback.message.answer(contacts_text, reply_markup=service_catalog.snapshot.contacts_keyboard)
 
 
 @router.message(RoomInput.waiting_room)
@@ -230,23 +252,16 @@ async def send_user_message_notification(appeal_id, username, room, message):
         logger.error(f"Error in send_user_message_notification: {e}")
 
 
-async def send_new_appeal_notification(appeal_id, room, service_type, description, comment=None):
+async def send_new_appeal_notification(appeal_id, room, service_type, description, comment=None, assignee=None):
     try:
         recipients = await get_notification_recipients(active_only=True)
 
         service_type_names = {
-            'iron': await get_message_template('service_iron') or '🧺 Утюг и гладильная доска',
-            'laundry': await get_message_template('service_laundry') or '👕 Услуги прачечной',
-            'technical_ac': await get_message_template('tech_ac') or '❄️ Кондиционер',
-            'technical_wifi': await get_message_template('tech_wifi') or '📶 WiFi',
-            'technical_tv': await get_message_template('tech_tv') or '📺 Телевизор',
-            'technical_other': await get_message_template('tech_other') or '🔧 Другие технические проблемы',
-            'restaurant_call': await get_message_template('connect_restaurant') or '📞 Соединить с рестораном',
             'custom': '❓ Другие вопросы',
             'other': '❓ Прочее'
         }
 
-        service_name = service_type_names.get(service_type, service_type)
+        service_name = service_catalog.type_label(service_type) or service_type_names.get(service_type, service_type)
 
         current_time = get_current_time_in_timezone()
         time_str = format_time_for_display(current_time)
@@ -271,6 +286,9 @@ async def send_new_appeal_notification(appeal_id, room, service_type, descriptio
         if comment:
             notification_text += f"💬 Комментарий: {comment}\n"
 
+        if assignee:
+            notification_text += f"👤 Ответственный: {admin_display_name(assignee)}\n"
+
         notification_text += f"\n🕗 Время: {time_str}"
 
         for recipient in recipients:
@@ -284,120 +302,129 @@ async def send_new_appeal_notification(appeal_id, room, service_type, descriptio
                 logger.info(f"Notification sent to {recipient['chat_id']} for appeal #{appeal_id}")
             except Exception as e:
                 logger.error(f"Failed to send notification to {recipient['chat_id']}: {e}")
+
+        # The assignee also hears about it directly unless the broadcast already reached them
+        if assignee and assignee['user_id'] not in {recipient['chat_id'] for recipient in recipients}:
+            try:
+                await bot.send_message(
+                    chat_id=assignee['user_id'],
+                    text=f"📌 <b>Вам назначена заявка #{appeal_id}</b>\n\n" + notification_text,
+                    parse_mode="HTML"
+                )
+            except Exception as e:
+                logger.error(f"Failed to notify assignee {assignee['user_id']} about appeal #{appeal_id}: {e}")
     except Exception as e:
         logger.error(f"Error in send_new_appeal_notification: {e}")
 
 
+def admin_display_name(admin):
+    return f"@{admin['username']}" if admin['username'] else str(admin['user_id'])
+
+
+# Admins with this role receive the second SLA escalation tier
+SLA_MANAGER_ROLE = 'manager'
+
+
+async def send_sla_escalation(appeal, tier, waited_minutes):
+    """Remind staff about an appeal still in 'new' past its SLA; from tier 2 on, managers are notified instead"""
+    chat_ids = []
+    if tier >= 2:
+        chat_ids = [admin['user_id'] for admin in await get_all_admins() if admin['role'] == SLA_MANAGER_ROLE]
+    if not chat_ids:
+        chat_ids = [recipient['chat_id'] for recipient in await get_notification_recipients(active_only=True)]
+        if appeal['assigned_admin'] and appeal['assigned_admin'] not in chat_ids:
+            chat_ids.append(appeal['assigned_admin'])
+
+    service_name = service_catalog.type_label(appeal['request_type']) or appeal['request_type']
+    template = await get_message_template('sla_escalation_notification')
+    values = dict(
+        appeal_id=appeal['id'], minutes=waited_minutes, room=appeal['room'],
+        service_name=service_name, description=appeal['text'], tier=tier
+    )
+    if template:
+        notification_text = template.format(**values)
+    else:
+        notification_text = f"""⏰ <b>Заявка #{values['appeal_id']} без ответа {waited_minutes} мин</b>
+
+🛏️ Комната: <b>{values['room']}</b>
+📋 Тип: {service_name}
+✉️ Описание: {values['description']}
+
+⚠️ Уровень эскалации: {tier}"""
+
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id=chat_id, text=notification_text, parse_mode="HTML")
+            logger.info(f"SLA escalation (tier {tier}) sent to {chat_id} for appeal #{appeal['id']}")
+        except Exception as e:
+            logger.error(f"Failed to send SLA escalation to {chat_id}: {e}")
+
+    await publish_event({
+        'type': 'sla_breach',
+        'appeal_id': appeal['id'],
+        'room': appeal['room'],
+        'request_type': appeal['request_type'],
+        'tier': tier,
+        'waited_minutes': waited_minutes,
+        'timestamp': datetime.now().isoformat()
+    }, ADMIN_NOTIFICATIONS_CHANNEL)
+
+
 async def create_service_request(user_id, username, room, service_type, description, optional_comment=None):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect('create_service_request')
     try:
         appeal_id = await conn.fetchval(
             "INSERT INTO appeals (user_id, username, room, text, request_type, optional_comment) VALUES ($1,$2,$3,$4,$5,$6) RETURNING id",
             user_id, username, room, description, service_type, optional_comment
         )
-        await add_message(appeal_id, "user", description)
-        if optional_comment:
-            await add_message(appeal_id, "user", f"Комментарий: {optional_comment}")
-
-        await send_new_appeal_notification(appeal_id, room, service_type, description, optional_comment)
     finally:
+        # Released before the helpers below take their own connections, so a busy pool cannot deadlock
         await conn.close()
+
+    await add_message(appeal_id, "user", description)
+    if optional_comment:
+        await add_message(appeal_id, "user", f"Комментарий: {optional_comment}")
+    # Right after the rows are committed, so the panel never caches pre-insert data past this point
+    await invalidate_panel_cache()
+
+    assignee = await assignment_engine.assign(appeal_id, service_type)
+    await send_new_appeal_notification(appeal_id, room, service_type, description, optional_comment, assignee)
+
+    await publish_event({
+        'type': 'new_appeal',
+        'appeal_id': appeal_id,
+        'user_id': user_id,
+        'username': username,
+        'room': room,
+        'text': description,
+        'request_type': service_type,
+        'assigned_admin': assignee['user_id'] if assignee else None,
+        'assigned_admin_name': admin_display_name(assignee) if assignee else None,
+        'timestamp': datetime.now().isoformat()
+    }, ADMIN_NOTIFICATIONS_CHANNEL)
+    await publish_event(stats_delta_event(
+        statuses={'new': 1}, total=1, today_count=1, types={service_type: 1}
+    ))
     return appeal_id
 
 
-@router.callback_query(F.data == "service_iron")
-async def service_iron(callback: CallbackQuery, state: FSMContext):
-    await callback.answer()
-    service_text = await get_message_template('service_iron') or "🧹 Нужен утюг и гладильная доска"
-    await state.update_data(service_text=service_text, service_type="iron")
-    add_comment_text = await get_message_template('add_comment') or "💬 Добавить комментарий"
-    send_no_comment_text = await get_message_template('send_no_comment') or "✅ Отправить без комментария"
-    comment_question = await get_message_template('comment_question') or "Хотите добавить комментарий к заявке?"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=add_comment_text, callback_data="add_comment")],
-        [InlineKeyboardButton(text=send_no_comment_text, callback_data="send_no_comment")]
-    ])
-    await callback.message.answer(comment_question, reply_markup=keyboard)
-
-@router.callback_query(F.data == "service_laundry")
-async def service_laundry(callback: CallbackQuery, state: FSMContext):
-    await callback.answer()
-    service_text = await get_message_template('service_laundry') or "👕 Услуги прачечной"
-    await state.update_data(service_text=service_text, service_type="laundry")
-    add_comment_text = await get_message_template('add_comment') or "💬 Добавить комментарий"
-    send_no_comment_text = await get_message_template('send_no_comment') or "✅ Отправить без комментария"
-    comment_question = await get_message_template('comment_question') or "Хотите добавить комментарий к заявке?"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=add_comment_text, callback_data="add_comment")],
-        [InlineKeyboardButton(text=send_no_comment_text, callback_data="send_no_comment")]
-    ])
-    await callback.message.answer(comment_question, reply_markup=keyboard)
-
-@router.callback_query(F.data == "service_technical")
-async def service_technical(callback: CallbackQuery, state: FSMContext):
-    await callback.answer()
-    tech_ac_text = await get_message_template('tech_ac') or "❄️ Кондиционер"
-    tech_wifi_text = await get_message_template('tech_wifi') or "📶 WiFi"
-    tech_tv_text = await get_message_template('tech_tv') or "📺 Телевизор"
-    tech_other_text = await get_message_template('tech_other') or "🔧 Другое"
-    back_services_text = await get_message_template('back_services') or "🔙 Назад"
-    service_technical_title = await get_message_template('service_technical') or "Выберите тип технической проблемы:"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=tech_ac_text, callback_data="tech_ac")],
-        [InlineKeyboardButton(text=tech_wifi_text, callback_data="tech_wifi")],
-        [InlineKeyboardButton(text=tech_tv_text, callback_data="tech_tv")],
-        [InlineKeyboardButton(text=tech_other_text, callback_data="tech_other")],
-        [InlineKeyboardButton(text=back_services_text, callback_data="back_services")]
-    ])
-    await callback.message.answer(service_technical_title, reply_markup=keyboard)
-
-@router.callback_query(F.data == "tech_ac")
-async def tech_ac(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(F.data.func(service_catalog.is_request))
+async def service_request(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    service_text = await get_message_template('tech_ac') or "❄️ Кондиционер"
-    await state.update_data(service_text=service_text, service_type="technical_ac")
-    add_comment_text = await get_message_template('add_comment') or "💬 Добавить комментарий"
-    send_no_comment_text = await get_message_template('send_no_comment') or "✅ Отправить без комментария"
-    comment_question = await get_message_template('comment_question') or "Хотите добавить комментарий к заявке?"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=add_comment_text, callback_data="add_comment")],
-        [InlineKeyboardButton(text=send_no_comment_text, callback_data="send_no_comment")]
-    ])
-    await callback.message.answer(comment_question, reply_markup=keyboard)
-
-@router.callback_query(F.data == "tech_wifi")
-async def tech_wifi(callback: CallbackQuery, state: FSMContext):
-    await callback.answer()
-    service_text = await get_message_template('tech_wifi') or "📶 WiFi"
-    await state.update_data(service_text=service_text, service_type="technical_wifi")
-    add_comment_text = await get_message_template('add_comment') or "💬 Добавить комментарий"
-    send_no_comment_text = await get_message_template('send_no_comment') or "✅ Отправить без комментария"
-    comment_question = await get_message_template('comment_question') or "Хотите добавить комментарий к заявке?"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=add_comment_text, callback_data="add_comment")],
-        [InlineKeyboardButton(text=send_no_comment_text, callback_data="send_no_comment")]
-    ])
-    await callback.message.answer(comment_question, reply_markup=keyboard)
-
-@router.callback_query(F.data == "tech_tv")
-async def tech_tv(callback: CallbackQuery, state: FSMContext):
+    snapshot = service_catalog.snapshot
+    entry = snapshot.requests.get(callback.data)
+    if not entry:
+        return
+    await state.update_data(service_text=entry.label, service_type=entry.request_type)
+    await callback.message.answer(snapshot.comment_prompt.title, reply_markup=snapshot.comment_prompt.keyboard)
+
+@router.callback_query(F.data.func(service_catalog.is_menu))
+async def service_submenu(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    service_text = await get_message_template('tech_tv') or "📺 Телевизор"
-    await state.update_data(service_text=service_text, service_type="technical_tv")
-    add_comment_text = await get_message_template('add_comment') or "💬 Добавить комментарий"
-    send_no_comment_text = await get_message_template('send_no_comment') or "✅ Отправить без комментария"
-    comment_question = await get_message_template('comment_question') or "Хотите добавить комментарий к заявке?"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=add_comment_text, callback_data="add_comment")],
-        [InlineKeyboardButton(text=send_no_comment_text, callback_data="send_no_comment")]
-    ])
-    await callback.message.answer(comment_question, reply_markup=keyboard)
+    menu = service_catalog.menu(callback.data)
+    if not menu:
+        return
+    await callback.message.answer(menu.title, reply_markup=menu.keyboard)
 
 @router.callback_query(F.data == "tech_other")
 async def tech_other(callback: CallbackQuery, state: FSMContext):
@@ -406,23 +433,6 @@ async def tech_other(callback: CallbackQuery, state: FSMContext):
     custom_problem_prompt = await get_message_template('custom_problem_prompt') or "Опишите проблему:"
     await callback.message.answer(custom_problem_prompt)
 
-@router.callback_query(F.data == "service_restaurant")
-async def service_restaurant(callback: CallbackQuery, state: FSMContext):
-    await callback.answer()
-    menu_room_service_text = await get_message_template('menu_room_service') or "📋 Меню рум-сервис"
-    menu_restaurant_text = await get_message_template('menu_restaurant') or "🍽 Меню ресторана"
-    connect_restaurant_text = await get_message_template('connect_restaurant') or "📞 Соедините с рестораном"
-    back_services_text = await get_message_template('back_services') or "🔙 Назад"
-    service_restaurant_title = await get_message_template('service_restaurant') or "Выберите услугу ресторана:"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=menu_room_service_text, callback_data="menu_room_service")],
-        [InlineKeyboardButton(text=menu_restaurant_text, callback_data="menu_restaurant")],
-        [InlineKeyboardButton(text=connect_restaurant_text, callback_data="connect_restaurant")],
-        [InlineKeyboardButton(text=back_services_text, callback_data="back_services")]
-    ])
-    await callback.message.answer(service_restaurant_title, reply_markup=keyboard)
-
 @router.callback_query(F.data == "menu_room_service")
 async def menu_room_service(callback: CallbackQuery):
     await callback.answer()
@@ -463,21 +473,6 @@ async def menu_restaurant(callback: CallbackQuery):
         menu_unavailable = await get_message_template('restaurant_menu_unavailable') or "🍽 Меню ресторана временно недоступно. Обратитесь к администратору."
         await callback.message.answer(menu_unavailable)
 
-@router.callback_query(F.data == "connect_restaurant")
-async def connect_restaurant(callback: CallbackQuery, state: FSMContext):
-    await callback.answer()
-    service_text = await get_message_template('connect_restaurant') or "📞 Соедините с рестораном"
-    await state.update_data(service_text=service_text, service_type="restaurant_call")
-    add_comment_text = await get_message_template('add_comment') or "💬 Добавить комментарий"
-    send_no_comment_text = await get_message_template('send_no_comment') or "✅ Отправить без комментария"
-    comment_question = await get_message_template('comment_question') or "Хотите добавить комментарий к заявке?"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=add_comment_text, callback_data="add_comment")],
-        [InlineKeyboardButton(text=send_no_comment_text, callback_data="send_no_comment")]
-    ])
-    await callback.message.answer(comment_question, reply_markup=keyboard)
-
 @router.callback_query(F.data == "service_other")
 async def service_other(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
@@ -546,13 +541,9 @@ async def process_service_request(event, state: FSMContext, comment: str = None)
 
     await state.update_data(last_appeal_id=appeal_id)
 
-    back_services_text = await get_message_template('back_services') or "🔙 Назад к услугам"
-    appeal_created_msg = await get_message_template('appeal_created') or "✅ Ваша заявка отправлена!"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=back_services_text, callback_data="back_services")]
-    ])
-    await message.answer(appeal_created_msg, reply_markup=keyboard)
+    snapshot = service_catalog.snapshot
+    appeal_created_msg = snapshot.text('appeal_created', "✅ Ваша заявка отправлена!")
+    await message.answer(appeal_created_msg, reply_markup=snapshot.back_keyboard)
 
 
 @router.callback_query(F.data.startswith("user_reopen:"))
@@ -566,11 +557,17 @@ async def user_reopen(callback: CallbackQuery):
         await callback.message.answer(invalid_appeal_id_msg)
         return
 
-    conn = await asyncpg.connect(DB_URL)
-    try:
-        await conn.execute("UPDATE appeals SET status = 'new' WHERE id = $1", appeal_id)
-    finally:
-        await conn.close()
+    changed = await change_status(appeal_id, 'new')
+
+    if changed and changed['previous_status'] != 'new':
+        await invalidate_panel_cache()
+        await publish_event({
+            'type': 'status_update',
+            'appeal_id': appeal_id,
+            'status': 'new',
+            'timestamp': datetime.now().isoformat()
+        })
+        await publish_event(stats_delta_event(statuses=status_change(changed['previous_status'], 'new')))
 
     reopen_message = await get_message_template('reopen_message') or "Мы снова передали ваше обращение администратору ✅"
     await callback.message.answer(reopen_message)
@@ -608,29 +605,57 @@ async def user_reply_text(message: Message, state: FSMContext):
 
     text = message.text.strip()
 
-    await add_message(appeal_id, "user", text)
+    message_id = await add_message(appeal_id, "user", text)
 
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect('user_reply_text')
     try:
         appeal = await conn.fetchrow("SELECT username, room FROM appeals WHERE id = $1", appeal_id)
         if appeal:
-            await conn.execute(
-                "UPDATE appeals SET status = 'new', updated_at = NOW() WHERE id = $1 AND status != 'new'",
-                appeal_id
-            )
+            previous_status = await conn.fetchval("""
+                UPDATE appeals a SET status = 'new', updated_at = NOW()
+                FROM (SELECT id, status FROM appeals WHERE id = $1 FOR UPDATE) prev
+                WHERE a.id = prev.id AND prev.status != 'new'
+                RETURNING prev.status
+            """, appeal_id)
 
             logger.info(f"New user reply on appeal {appeal_id}: {text}")
             logger.info(f"Appeal {appeal_id} status updated to 'new' due to user reply")
-
-            await send_user_message_notification(appeal_id, appeal['username'], appeal['room'], text)
     finally:
+        # Released before notifying: the notification takes its own connections and waits on Telegram
         await conn.close()
 
+    if appeal:
+        await invalidate_panel_cache()
+        await send_user_message_notification(appeal_id, appeal['username'], appeal['room'], text)
+        now = datetime.now().isoformat()
+        await publish_event({
+            'type': 'new_message',
+            'appeal_id': appeal_id,
+            'message_id': message_id,
+            'sender': 'user',
+            'message': text,
+            'timestamp': now
+        })
+        if previous_status:
+            await publish_event({
+                'type': 'status_update',
+                'appeal_id': appeal_id,
+                'status': 'new',
+                'timestamp': now
+            })
+            await publish_event(stats_delta_event(statuses=status_change(previous_status, 'new')))
+
     reply_sent_msg = await get_message_template('reply_sent') or "✅ Ваш ответ отправлен администратору!"
     await message.answer(reply_sent_msg)
     await state.clear()
 
 
+@dp.update.outer_middleware()
+async def count_db_round_trips(handler, event, data):
+    async with track_unit('bot', event.event_type):
+        return await handler(event, data)
+
+
 @dp.errors()
 async def global_error_handler(event, data):
     exception = data.get('exception')
@@ -640,7 +665,7 @@ async def global_error_handler(event, data):
 async def check_message_queue():
     while True:
         try:
-            conn = await asyncpg.connect(DB_URL)
+            conn = await connect('check_message_queue')
             try:
                 pending_messages = await conn.fetch(
                     """SELECT id, user_id, message, appeal_id, created_at 
@@ -724,28 +749,19 @@ async def check_message_queue():
         await asyncio.sleep(5)
 
 async def main():
-    logger.info("Инициализация БД...")
-    await init_db()
-    await init_message_templates()
-    await init_settings()
-
-    conn = await asyncpg.connect(DB_URL)
-    try:
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS pending_admin_messages (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                message TEXT NOT NULL,
-                appeal_id INTEGER,
-                sent BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-    finally:
-        await conn.close()
+    # Schema is created by the one-shot `python -m db.migrate` step
+    await init_redis()
+    await service_catalog.load()
+    await start_metrics_server(METRICS_PORT)
 
     logger.info("Запуск polling и проверки очереди сообщений...")
     asyncio.create_task(check_message_queue())
+    asyncio.create_task(service_catalog.watch())
+    if redis_client:
+        asyncio.create_task(sla_escalator.run(redis_client, send_sla_escalation))
+        asyncio.create_task(assignment_engine.run(redis_client))
+    else:
+        logger.error("Redis unavailable, SLA escalation and automatic assignment disabled")
 
     await dp.start_polling(bot)
 
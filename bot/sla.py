@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import time
+from redis.exceptions import ResponseError
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db.db import get_all_settings, get_appeal_summary, get_new_appeals_for_sla
+from db.streams import APPEAL_EVENTS_STREAM
+
+logger = logging.getLogger(__name__)
+
+# Due time (unix seconds) of the next escalation of every appeal waiting in 'new'
+SLA_DUE_KEY = 'sla:due'
+# Last escalation tier fired per appeal, kept until the appeal leaves 'new'
+SLA_TIER_KEY = 'sla:tier'
+SLA_GROUP = 'sla'
+
+DEFAULT_SLA_MINUTES = 15
+# Tier 1 goes to the usual notification recipients, tier 2 to managers; each tier is one more SLA period later
+ESCALATION_TIERS = 2
+MAX_WAIT = 5
+DUE_BATCH = 50
+EVENT_BATCH = 100
+SETTINGS_REFRESH = 60
+# Delay before an escalation that failed (database or Redis error) is tried again
+RETRY_DELAY = 60
+
+
+class SlaEscalator:
+    """Escalates appeals that stay in 'new' longer than the SLA of their request type
+
+    Due times live in one Redis sorted set, so each tick costs O(log n) plus the appeals actually
+    due, however many are open. The schedule follows the appeal event log (stream:appeal_events):
+    new appeals are added, appeals leaving 'new' are removed, reopened ones are added again.
+    """
+
+    def __init__(self):
+        self.redis = None
+        self.notify = None
+        self.consumer = f"bot-{os.getpid()}"
+        self.sla_settings = {}
+        self.settings_loaded_at = 0.0
+
+    async def refresh_settings(self):
+        if time.monotonic() - self.settings_loaded_at < SETTINGS_REFRESH:
+            return
+        rows = await get_all_settings()
+        self.sla_settings = {row['key']: row['value'] for row in rows if row['key'].startswith('sla_')}
+        self.settings_loaded_at = time.monotonic()
+
+    def sla_minutes(self, request_type):
+        for key in (f"sla_{request_type}", 'sla_default'):
+            try:
+                return max(1, int(self.sla_settings[key]))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return DEFAULT_SLA_MINUTES
+
+    async def schedule(self, appeal_id, request_type, since):
+        await self.redis.hdel(SLA_TIER_KEY, appeal_id)
+        await self.redis.zadd(SLA_DUE_KEY, {appeal_id: since + self.sla_minutes(request_type) * 60})
+
+    async def cancel(self, *appeal_ids):
+        if appeal_ids:
+            await self.redis.zrem(SLA_DUE_KEY, *appeal_ids)
+            await self.redis.hdel(SLA_TIER_KEY, *appeal_ids)
+
+    async def ensure_group(self):
+        try:
+            await self.redis.xgroup_create(APPEAL_EVENTS_STREAM, SLA_GROUP, id='$', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def bootstrap(self):
+        """Schedule appeals created while nothing was following the event log, e.g. before the first start"""
+        added = 0
+        for appeal in await get_new_appeals_for_sla():
+            if await self.redis.hexists(SLA_TIER_KEY, appeal['id']):
+                continue
+            due = appeal['created_at'].timestamp() + self.sla_minutes(appeal['request_type']) * 60
+            added += await self.redis.zadd(SLA_DUE_KEY, {appeal['id']: due}, nx=True)
+        if added:
+            logger.info(f"SLA schedule: added {added} waiting appeals")
+
+    async def apply_event(self, entry_id, event):
+        # The entry id starts with the time the event was logged in milliseconds
+        logged_at = int(entry_id.split('-', 1)[0]) / 1000
+        event_type = event.get('type')
+        if event_type == 'new_appeal':
+            await self.schedule(event['appeal_id'], event.get('request_type'), logged_at)
+        elif event_type == 'status_update':
+            if event.get('status') == 'new':
+                appeal = await get_appeal_summary(event['appeal_id'])
+                if appeal:
+                    await self.schedule(appeal['id'], appeal['request_type'], logged_at)
+            else:
+                await self.cancel(event['appeal_id'])
+        elif event_type == 'bulk_update' and event.get('appeal_ids'):
+            if event.get('status') != 'new':
+                await self.cancel(*event['appeal_ids'])
+
+    async def read_events(self, block_ms):
+        response = await self.redis.xreadgroup(
+            SLA_GROUP, self.consumer, {APPEAL_EVENTS_STREAM: '>'}, count=EVENT_BATCH, block=block_ms
+        )
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+                try:
+                    await self.apply_event(entry_id, json.loads(fields[b'data']))
+                except Exception as e:
+                    logger.error(f"Could not apply appeal event {entry_id} to the SLA schedule: {e}")
+                await self.redis.xack(APPEAL_EVENTS_STREAM, SLA_GROUP, entry_id)
+
+    async def fire_due(self):
+        now = time.time()
+        for member in await self.redis.zrangebyscore(SLA_DUE_KEY, '-inf', now, start=0, num=DUE_BATCH):
+            # Only the process whose ZREM succeeds escalates, so a second bot instance cannot double-notify
+            if await self.redis.zrem(SLA_DUE_KEY, member):
+                try:
+                    await self.escalate(int(member))
+                except Exception as e:
+                    logger.error(f"SLA escalation for appeal #{int(member)} failed, retrying in {RETRY_DELAY}s: {e}")
+                    # NX: escalate may already have scheduled the next tier
+                    await self.redis.zadd(SLA_DUE_KEY, {member: time.time() + RETRY_DELAY}, nx=True)
+
+    async def escalate(self, appeal_id):
+        appeal = await get_appeal_summary(appeal_id)
+        if not appeal or appeal['status'] != 'new':
+            await self.redis.hdel(SLA_TIER_KEY, appeal_id)
+            return
+        tier = await self.redis.hincrby(SLA_TIER_KEY, appeal_id, 1)
+        minutes = self.sla_minutes(appeal['request_type'])
+        if tier < ESCALATION_TIERS:
+            await self.redis.zadd(SLA_DUE_KEY, {appeal_id: time.time() + minutes * 60})
+        waited = int((time.time() - appeal['created_at'].timestamp()) // 60)
+        try:
+            await self.notify(appeal, tier, waited)
+        except Exception as e:
+            logger.error(f"SLA escalation for appeal #{appeal_id} failed: {e}")
+
+    async def seconds_to_next_due(self):
+        head = await self.redis.zrange(SLA_DUE_KEY, 0, 0, withscores=True)
+        if not head:
+            return MAX_WAIT
+        return min(MAX_WAIT, max(0.0, head[0][1] - time.time()))
+
+    async def run(self, redis_client, notify):
+        """notify(appeal, tier, waited_minutes) sends the escalation; tiers start at 1"""
+        self.redis = redis_client
+        self.notify = notify
+        while True:
+            try:
+                await self.refresh_settings()
+                await self.ensure_group()
+                await self.bootstrap()
+                break
+            except Exception as e:
+                logger.error(f"SLA escalation could not start: {e}")
+                await asyncio.sleep(MAX_WAIT)
+        logger.info("SLA escalation started")
+
+        while True:
+            try:
+                await self.refresh_settings()
+                await self.fire_due()
+                wait = await self.seconds_to_next_due()
+                # BLOCK 0 would wait forever
+                await self.read_events(max(1, int(wait * 1000)))
+            except asyncio.CancelledError:
+                raise
+            except ResponseError as e:
+                if 'NOGROUP' in str(e):
+                    await self.ensure_group()
+                else:
+                    logger.error(f"SLA escalation error: {e}")
+                    await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"SLA escalation error: {e}")
+                await asyncio.sleep(1)
+
+
+sla_escalator = SlaEscalator()
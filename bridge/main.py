@@ -3,123 +3,303 @@ import logging
 import json
 import sys
 import os
+import signal
+import socket
+import time
 import redis.asyncio as redis
+from redis.exceptions import ResponseError
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from prometheus_client import Counter, Gauge, Histogram
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import TOKEN, DB_URL
+from config import TOKEN, DB_URL, REDIS_URL
+from db.streams import (
+    TELEGRAM_STREAM, STATUS_STREAM, DEAD_LETTER_STREAM, BRIDGE_GROUP, LEGACY_QUEUES, add_to_stream,
+    ADMIN_NOTIFICATIONS_CHANNEL, publish_admin_event
+)
+from db.metrics import start_metrics_server
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+READ_COUNT = 10
+BLOCK_MS = 5000
+RECLAIM_INTERVAL = 30
+RECLAIM_IDLE_MS = 60000
+MAX_DELIVERIES = 5
+WORKER_COUNT = int(os.getenv('BRIDGE_WORKERS', '8'))
+WORKER_QUEUE_SIZE = 50
+DRAIN_TIMEOUT = 20
+SEND_ATTEMPTS = 3
+METRICS_PORT = int(os.getenv('BRIDGE_METRICS_PORT', '8081'))
+METRICS_INTERVAL = 10
+# /health reports the bridge as falling behind past these limits
+HEALTH_MAX_PENDING_AGE = int(os.getenv('BRIDGE_HEALTH_MAX_PENDING_AGE', '120'))
+HEALTH_MAX_LOOP_STALL = 60
+
+STREAM_LENGTH = Gauge('bridge_stream_length', 'Entries kept in the stream', ['stream'])
+STREAM_PENDING = Gauge('bridge_stream_pending', 'Entries delivered but not yet acknowledged', ['stream'])
+STREAM_LAG = Gauge('bridge_stream_lag', 'Entries not yet delivered to the consumer group', ['stream'])
+OLDEST_PENDING_AGE = Gauge('bridge_oldest_pending_age_seconds', 'Age of the oldest unacknowledged entry', ['stream'])
+LOCAL_QUEUE_SIZE = Gauge('bridge_local_queue_size', 'Entries dispatched to workers and not finished yet')
+MESSAGE_AGE = Histogram(
+    'bridge_message_age_seconds', 'Time from XADD until the bridge read the entry', ['stream'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+)
+SEND_LATENCY = Histogram('bridge_send_latency_seconds', 'Telegram send latency', ['stream'])
+PROCESSED = Counter('bridge_messages_processed_total', 'Entries processed', ['stream', 'result'])
+RETRIES = Counter('bridge_retries_total', 'Send retries inside a worker and redeliveries from reclaim', ['stream', 'reason'])
+ERRORS = Counter('bridge_errors_total', 'Send errors by class', ['stream', 'error'])
+
+
+def entry_age(entry_id):
+    """Seconds since an entry was added, from the millisecond part of its stream id"""
+    return max(time.time() - int(entry_id.split('-', 1)[0]) / 1000, 0)
+
+
 class MessageBridge:
     def __init__(self):
         self.bot = Bot(TOKEN)
         self.redis_client = None
-        
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.handlers = {
+            TELEGRAM_STREAM: self.send_telegram_message,
+            STATUS_STREAM: self.handle_status_update,
+        }
+        self.queues = []
+        self.workers = []
+        self.in_flight = set()
+        self.running = False
+        self.last_loop_at = time.monotonic()
+        self.oldest_pending_age = {}
+        self.metrics_runner = None
+
     async def init_redis(self):
         try:
-            self.redis_client = redis.Redis(host='redis', port=6379, db=0)
+            self.redis_client = redis.from_url(REDIS_URL, decode_responses=True)
             await self.redis_client.ping()
             logger.info("Redis connection established")
         except Exception as e:
             logger.error(f"Redis connection failed: {e}")
             self.redis_client = None
 
-    async def process_telegram_messages(self):
-        if not self.redis_client:
-            return
-            
-        try:
-            message_data = await self.redis_client.brpop('telegram_messages', timeout=1)
-            
-            if message_data:
-                queue_name, message_json = message_data
-                message = json.loads(message_json)
-                
-                await self.send_telegram_message(message)
-                logger.info(f"Sent message to Telegram user {message['user_id']}")
-                
-        except Exception as e:
-            logger.error(f"Error processing telegram messages: {e}")
+    async def ensure_groups(self):
+        for stream in self.handlers:
+            try:
+                await self.redis_client.xgroup_create(stream, BRIDGE_GROUP, id='0', mkstream=True)
+                logger.info(f"Created consumer group {BRIDGE_GROUP} on {stream}")
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
 
-    async def send_telegram_message(self, message_data):
-        try:
-            user_id = message_data['user_id']
-            text = message_data['message']
-            appeal_id = message_data.get('appeal_id')
-            
-            reply_markup = None
-            if appeal_id and message_data.get('add_reopen_button', False):
-                from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-                reply_markup = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="❗ Вопрос не решили", callback_data=f"user_reopen:{appeal_id}")]
-                ])
-            
-            await self.bot.send_message(
-                chat_id=user_id,
-                text=text,
-                reply_markup=reply_markup
-            )
-            
-        except Exception as e:
-            logger.error(f"Failed to send telegram message: {e}")
+    async def migrate_legacy_lists(self):
+        for list_name, stream in LEGACY_QUEUES.items():
+            moved = 0
+            while True:
+                item = await self.redis_client.rpop(list_name)
+                if item is None:
+                    break
+                await self.redis_client.xadd(stream, {'data': item})
+                moved += 1
+            if moved:
+                logger.info(f"Moved {moved} pending items from list {list_name} to {stream}")
 
-    async def process_status_updates(self):
-        if not self.redis_client:
-            return
-            
+    async def read_new_messages(self):
+        response = await self.redis_client.xreadgroup(
+            BRIDGE_GROUP, self.consumer,
+            {stream: '>' for stream in self.handlers},
+            count=READ_COUNT, block=BLOCK_MS
+        )
+        for stream, entries in response or []:
+            for entry_id, fields in entries:
+                await self.dispatch(stream, entry_id, fields)
+
+    async def dispatch(self, stream, entry_id, fields):
+        """Hand an entry to the worker owning its chat; blocks while that worker's queue is full"""
         try:
-            status_data = await self.redis_client.brpop('status_updates', timeout=1)
-            
-            if status_data:
-                queue_name, status_json = status_data
-                update = json.loads(status_json)
-                
-                await self.handle_status_update(update)
-                logger.info(f"Processed status update for appeal {update['appeal_id']}")
-                
+            payload = json.loads(fields['data'])
         except Exception as e:
-            logger.error(f"Error processing status updates: {e}")
+            logger.error(f"Malformed {stream} entry {entry_id}: {e}")
+            return
+        # All entries for one chat go to the same worker, so per-chat order is kept
+        MESSAGE_AGE.labels(stream).observe(entry_age(entry_id))
+        worker_index = hash(payload.get('user_id')) % len(self.queues)
+        self.in_flight.add(entry_id)
+        LOCAL_QUEUE_SIZE.set(len(self.in_flight))
+        await self.queues[worker_index].put((stream, entry_id, payload))
 
-    async def handle_status_update(self, update):
-        try:
-            appeal_id = update['appeal_id']
-            status = update['status']
-            user_id = update['user_id']
-            
+    async def worker(self, queue):
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                await self.process_entry(*item)
+            finally:
+                if item is not None:
+                    self.in_flight.discard(item[1])
+                    LOCAL_QUEUE_SIZE.set(len(self.in_flight))
+                queue.task_done()
+
+    def start_workers(self):
+        self.queues = [asyncio.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(WORKER_COUNT)]
+        self.workers = [asyncio.create_task(self.worker(queue)) for queue in self.queues]
+        logger.info(f"Started {WORKER_COUNT} bridge workers")
+
+    async def drain_workers(self):
+        """Let workers finish everything already dispatched; unfinished entries stay pending in the stream"""
+        for queue in self.queues:
+            # Never block here: a full queue would hold shutdown past DRAIN_TIMEOUT. Its worker has
+            # no stop marker then and is cancelled at the timeout like any other unfinished one
+            try:
+                queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+        done, pending = await asyncio.wait(self.workers, timeout=DRAIN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"{len(pending)} bridge workers did not drain in {DRAIN_TIMEOUT}s; their entries will be reclaimed")
+        self.workers = []
+
+    def stop(self):
+        logger.info("Shutting down message bridge...")
+        self.running = False
 
-            if status == 'received':
-                logger.info(f"Skipping notification for 'received' status on appeal {appeal_id}")
+    async def process_entry(self, stream, entry_id, payload):
+        for attempt in range(1, SEND_ATTEMPTS + 1):
+            started = time.perf_counter()
+            try:
+                await self.handlers[stream](payload)
+                SEND_LATENCY.labels(stream).observe(time.perf_counter() - started)
+                PROCESSED.labels(stream, 'sent').inc()
+                break
+            except TelegramRetryAfter as e:
+                ERRORS.labels(stream, 'flood_control').inc()
+                logger.warning(f"Flood control on {stream} entry {entry_id}, retrying in {e.retry_after}s")
+                delay = e.retry_after
+            except TelegramNetworkError as e:
+                ERRORS.labels(stream, 'network').inc()
+                logger.warning(f"Network error on {stream} entry {entry_id}: {e}")
+                delay = 2 ** attempt
+            except TelegramForbiddenError as e:
+                # The guest blocked the bot; retrying will not help
+                ERRORS.labels(stream, 'forbidden').inc()
+                PROCESSED.labels(stream, 'dropped').inc()
+                logger.error(f"Dropping {stream} entry {entry_id}: {e}")
+                break
+            except TelegramBadRequest as e:
+                ERRORS.labels(stream, 'bad_request').inc()
+                PROCESSED.labels(stream, 'dropped').inc()
+                logger.error(f"Dropping {stream} entry {entry_id}: {e}")
+                break
+            except Exception as e:
+                # Left unacknowledged: the entry stays pending and is retried by reclaim_pending
+                ERRORS.labels(stream, 'other').inc()
+                PROCESSED.labels(stream, 'failed').inc()
+                logger.error(f"Error processing {stream} entry {entry_id}: {e}")
                 return
-            
-            status_messages = {
-                'done': 'Ваше обращение выполнено ✅',
-                'declined': 'Ваше обращение отклонено ❌'
+
+            if attempt == SEND_ATTEMPTS:
+                PROCESSED.labels(stream, 'failed').inc()
+                return
+            RETRIES.labels(stream, 'send').inc()
+            await asyncio.sleep(delay)
+
+        await self.redis_client.xack(stream, BRIDGE_GROUP, entry_id)
+
+    async def reclaim_pending(self):
+        """Take over entries left pending by crashed or stuck consumers"""
+        for stream in self.handlers:
+            pending = await self.redis_client.xpending_range(
+                stream, BRIDGE_GROUP, min='-', max='+', count=READ_COUNT, idle=RECLAIM_IDLE_MS
+            )
+            if not pending:
+                continue
+
+            # Entries still queued for our own workers are not stale, just waiting
+            deliveries = {
+                item['message_id']: item['times_delivered']
+                for item in pending if item['message_id'] not in self.in_flight
             }
-            
-            message_text = status_messages.get(status, f'Статус вашего обращения изменен: {status}')
-            
-            reply_markup = None
-            if status == 'done':
-                from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-                reply_markup = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="❗ Вопрос не решили", callback_data=f"user_reopen:{appeal_id}")]
-                ])
-            
-            await self.bot.send_message(
-                chat_id=user_id,
-                text=message_text,
-                reply_markup=reply_markup
+            if not deliveries:
+                continue
+            claimed = await self.redis_client.xclaim(
+                stream, BRIDGE_GROUP, self.consumer, RECLAIM_IDLE_MS, list(deliveries)
             )
-            
-        except Exception as e:
-            logger.error(f"Failed to handle status update: {e}")
+            for entry_id, fields in claimed:
+                if deliveries.get(entry_id, 0) >= MAX_DELIVERIES:
+                    await self.dead_letter(stream, entry_id, fields)
+                    continue
+                logger.info(f"Retrying {stream} entry {entry_id} (delivery {deliveries.get(entry_id, 0) + 1})")
+                RETRIES.labels(stream, 'reclaim').inc()
+                await self.dispatch(stream, entry_id, fields)
+
+    async def dead_letter(self, stream, entry_id, fields):
+        PROCESSED.labels(stream, 'dead_letter').inc()
+        logger.error(f"Giving up on {stream} entry {entry_id} after {MAX_DELIVERIES} deliveries")
+        await add_to_stream(self.redis_client, DEAD_LETTER_STREAM, {
+            'stream': stream,
+            'entry_id': entry_id,
+            'data': (fields or {}).get('data')
+        }, maxlen=10000)
+        await self.redis_client.xack(stream, BRIDGE_GROUP, entry_id)
+
+    async def send_telegram_message(self, message_data):
+        user_id = message_data['user_id']
+        text = message_data['message']
+        appeal_id = message_data.get('appeal_id')
+
+        reply_markup = None
+        if appeal_id and message_data.get('add_reopen_button', False):
+            from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+            reply_markup = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="❗ Вопрос не решили", callback_data=f"user_reopen:{appeal_id}")]
+            ])
+
+        await self.bot.send_message(
+            chat_id=user_id,
+            text=text,
+            reply_markup=reply_markup
+        )
+        logger.info(f"Sent message to Telegram user {user_id}")
+
+    async def handle_status_update(self, update):
+        appeal_id = update['appeal_id']
+        status = update['status']
+        user_id = update['user_id']
+
+
+        if status == 'received':
+            logger.info(f"Skipping notification for 'received' status on appeal {appeal_id}")
+            return
+
+        status_messages = {
+            'done': 'Ваше обращение выполнено ✅',
+            'declined': 'Ваше обращение отклонено ❌'
+        }
+
+        message_text = status_messages.get(status, f'Статус вашего обращения изменен: {status}')
+
+        reply_markup = None
+        if status == 'done':
+            from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+            reply_markup = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="❗ Вопрос не решили", callback_data=f"user_reopen:{appeal_id}")]
+            ])
+
+        await self.bot.send_message(
+            chat_id=user_id,
+            text=message_text,
+            reply_markup=reply_markup
+        )
+        logger.info(f"Processed status update for appeal {appeal_id}")
 
     async def notify_new_appeal(self, appeal_data):
         if not self.redis_client:
             return
-            
+
         try:
             notification = {
                 'type': 'new_appeal',
@@ -130,38 +310,99 @@ class MessageBridge:
                 'text': appeal_data['text'],
                 'timestamp': appeal_data['timestamp']
             }
-            
-            await self.redis_client.publish('admin_notifications', json.dumps(notification))
+
+            await publish_admin_event(self.redis_client, notification, ADMIN_NOTIFICATIONS_CHANNEL)
             logger.info(f"Published new appeal notification for {appeal_data['appeal_id']}")
-            
+
         except Exception as e:
             logger.error(f"Failed to notify new appeal: {e}")
 
+    async def collect_stream_metrics(self):
+        for stream in self.handlers:
+            STREAM_LENGTH.labels(stream).set(await self.redis_client.xlen(stream))
+
+            summary = await self.redis_client.xpending(stream, BRIDGE_GROUP)
+            STREAM_PENDING.labels(stream).set(summary['pending'])
+            age = entry_age(summary['min']) if summary['pending'] else 0
+            OLDEST_PENDING_AGE.labels(stream).set(age)
+            self.oldest_pending_age[stream] = age
+
+            for group in await self.redis_client.xinfo_groups(stream):
+                if group['name'] == BRIDGE_GROUP and group.get('lag') is not None:
+                    STREAM_LAG.labels(stream).set(group['lag'])
+
+    async def metrics_loop(self):
+        while self.running:
+            try:
+                await self.collect_stream_metrics()
+            except Exception as e:
+                logger.error(f"Error collecting bridge metrics: {e}")
+            await asyncio.sleep(METRICS_INTERVAL)
+
+    async def health_check(self):
+        details = {
+            'oldest_pending_age': {stream: round(age, 1) for stream, age in self.oldest_pending_age.items()},
+            'local_queue_size': len(self.in_flight),
+            'loop_stalled_for': round(time.monotonic() - self.last_loop_at, 1),
+        }
+        if not self.running or details['loop_stalled_for'] > HEALTH_MAX_LOOP_STALL:
+            return False, {**details, 'reason': 'reader loop is not running'}
+        try:
+            await self.redis_client.ping()
+        except Exception as e:
+            return False, {**details, 'reason': f'redis unavailable: {e}'}
+        if any(age > HEALTH_MAX_PENDING_AGE for age in self.oldest_pending_age.values()):
+            return False, {**details, 'reason': 'falling behind'}
+        return True, details
+
     async def run(self):
         await self.init_redis()
-        
+
         if not self.redis_client:
             logger.error("Cannot start bridge without Redis connection")
             return
-            
-        logger.info("Message bridge started")
-        
-        while True:
+
+        await self.ensure_groups()
+        await self.migrate_legacy_lists()
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+
+        self.start_workers()
+        self.running = True
+        self.metrics_runner = await start_metrics_server(METRICS_PORT, self.health_check)
+        metrics_task = asyncio.create_task(self.metrics_loop())
+        logger.info(f"Message bridge started as consumer {self.consumer}")
+
+        next_reclaim = loop.time()
+
+        while self.running:
+            self.last_loop_at = time.monotonic()
             try:
-                await self.process_telegram_messages()
-                
-                await self.process_status_updates()
-                
-                await asyncio.sleep(0.1)
-                
-            except KeyboardInterrupt:
-                logger.info("Shutting down message bridge...")
-                break
+                if loop.time() >= next_reclaim:
+                    await self.reclaim_pending()
+                    next_reclaim = loop.time() + RECLAIM_INTERVAL
+
+                await self.read_new_messages()
+
+            except ResponseError as e:
+                if 'NOGROUP' in str(e):
+                    await self.ensure_groups()
+                else:
+                    logger.error(f"Unexpected error in bridge: {e}")
+                    await asyncio.sleep(1)
             except Exception as e:
                 logger.error(f"Unexpected error in bridge: {e}")
                 await asyncio.sleep(1)
 
+        await self.drain_workers()
+        metrics_task.cancel()
+        logger.info("Message bridge stopped")
+
     async def cleanup(self):
+        if self.metrics_runner:
+            await self.metrics_runner.cleanup()
         if self.redis_client:
             await self.redis_client.close()
         await self.bot.session.close()
@@ -176,4 +417,4 @@ async def main():
         await bridge.cleanup()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -8,4 +8,8 @@ if os.path.exists('.env'):
 TOKEN = os.getenv('TOKEN') or config.get('TOKEN')
 ADMIN_ID = os.getenv('ADMIN_ID') or config.get('ADMIN_ID')
 DB_URL = os.getenv('DB_URL') or config.get('DB_URL')
-ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD') or config.get('ADMIN_PASSWORD', 'admin123')
\ No newline at end of file
+ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD') or config.get('ADMIN_PASSWORD', 'admin123')
+REDIS_URL = os.getenv('REDIS_URL') or config.get('REDIS_URL', 'redis://redis:6379/0')
+# Every web worker opens its own pool of up to DB_POOL_MAX_SIZE connections, so keep
+# WEB_WORKERS * DB_POOL_MAX_SIZE plus the bot's pool below Postgres max_connections (100 by default)
+WEB_WORKERS = int(os.getenv('WEB_WORKERS') or config.get('WEB_WORKERS') or 2)
\ No newline at end of file
@@ -1,14 +1,19 @@
-import asyncpg
+import asyncio
 import sys
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DB_URL
+from db.instrument import connect, instrumented
 
+# Tables whose changes are counted for cheap cache validators (ETags) in the admin panel
+VERSIONED_TABLES = ('appeals', 'messages', 'message_templates', 'settings', 'notification_settings', 'service_catalog')
+TABLE_VERSIONS_CHANNEL = 'table_versions'
 
+
+@instrumented
 async def init_db():
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         await conn.execute("""
         CREATE TABLE IF NOT EXISTS appeals (
@@ -101,21 +106,80 @@ async def init_db():
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """)
+
+        await conn.execute("""
+        CREATE TABLE IF NOT EXISTS service_catalog (
+            id SERIAL PRIMARY KEY,
+            key TEXT NOT NULL,
+            parent TEXT NOT NULL DEFAULT '',
+            kind TEXT NOT NULL DEFAULT 'request',
+            request_type TEXT,
+            label_key TEXT,
+            label TEXT,
+            title_key TEXT,
+            title TEXT,
+            row_num INT DEFAULT 0,
+            position INT DEFAULT 0,
+            is_active BOOLEAN DEFAULT true,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (parent, key)
+        );
+        """)
+        await conn.execute("""
+        CREATE TABLE IF NOT EXISTS bulk_jobs (
+            id SERIAL PRIMARY KEY,
+            status TEXT NOT NULL,
+            appeal_ids INTEGER[] NOT NULL,
+            message TEXT,
+            processed INT DEFAULT 0,
+            total INT NOT NULL,
+            state TEXT DEFAULT 'running',
+            admin TEXT,
+            error TEXT,
+            locked_until TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_appeals_status ON appeals(status);")
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_appeals_room ON appeals(room);")
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_appeals_created_at ON appeals(created_at);")
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_appeals_user_id ON appeals(user_id);")
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_appeals_request_type ON appeals(request_type);")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_appeal_created ON messages(appeal_id, created_at, id);")
+        await init_last_message_times(conn)
+        await init_outbox(conn)
+
+        # One sequence per table, bumped once per writing statement and announced with NOTIFY.
+        # Sequences are not transactional, so concurrent writers never wait on each other here.
+        await conn.execute(f"""
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{TABLE_VERSIONS_CHANNEL}', TG_TABLE_NAME || ':' || nextval(TG_TABLE_NAME || '_version_seq'));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+        for table in VERSIONED_TABLES:
+            await conn.execute(f"CREATE SEQUENCE IF NOT EXISTS {table}_version_seq;")
+            await conn.execute(f"""
+            CREATE OR REPLACE TRIGGER {table}_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+            """)
 
         await init_settings()
         await init_message_templates()
+        await init_service_catalog()
 
     finally:
         await conn.close()
 
 
+@instrumented
 async def create_appeal(user_id, username, room, text, request_type='other', optional_comment=None):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         appeal_id = await conn.fetchval(
             "INSERT INTO appeals (user_id, username, room, text, request_type, optional_comment) VALUES ($1,$2,$3,$4,$5,$6) RETURNING id",
@@ -126,82 +190,297 @@ async def create_appeal(user_id, username, room, text, request_type='other', opt
     return appeal_id
 
 
+# Who spoke last in a conversation; matches the partial indexes created in init_last_message_times
+AWAITING_FILTERS = {
+    'guest': "last_admin_msg_at > COALESCE(last_user_msg_at, '-infinity'::timestamp)",
+    'admin': "last_user_msg_at > COALESCE(last_admin_msg_at, '-infinity'::timestamp)",
+}
+
+
+async def init_last_message_times(conn):
+    """Denormalized time of the last admin and last guest message on each appeal, backfilled on first run"""
+    exists = await conn.fetchval("""
+        SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'appeals' AND column_name = 'last_admin_msg_at')
+    """)
+    await conn.execute("ALTER TABLE appeals ADD COLUMN IF NOT EXISTS last_admin_msg_at TIMESTAMP;")
+    await conn.execute("ALTER TABLE appeals ADD COLUMN IF NOT EXISTS last_user_msg_at TIMESTAMP;")
+    if not exists:
+        await refresh_last_message_times(conn)
+    for awaiting, condition in AWAITING_FILTERS.items():
+        await conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_appeals_awaiting_{awaiting} ON appeals(created_at) WHERE {condition};
+        """)
+
+
+async def refresh_last_message_times(conn, appeal_ids=None):
+    """Recompute last_admin_msg_at/last_user_msg_at from messages (after bulk loads that bypass add_message)"""
+    await conn.execute("""
+        UPDATE appeals a
+        SET last_admin_msg_at = m.last_admin, last_user_msg_at = m.last_user
+        FROM (
+            SELECT appeal_id,
+                   MAX(created_at) FILTER (WHERE sender = 'admin') AS last_admin,
+                   MAX(created_at) FILTER (WHERE sender = 'user') AS last_user
+            FROM messages
+            WHERE $1::int[] IS NULL OR appeal_id = ANY($1)
+            GROUP BY appeal_id
+        ) m
+        WHERE a.id = m.appeal_id
+    """, appeal_ids)
+
+
+@instrumented
 async def add_message(appeal_id, sender, text):
-    conn = await asyncpg.connect(DB_URL)
+    """Store a conversation message, stamp it on the appeal and return its id"""
+    conn = await connect()
     try:
-        await conn.execute(
-            "INSERT INTO messages (appeal_id, sender, text) VALUES ($1,$2,$3)",
-            appeal_id, sender, text
-        )
+        return await conn.fetchval("""
+            WITH m AS (
+                INSERT INTO messages (appeal_id, sender, text) VALUES ($1, $2, $3)
+                RETURNING id, created_at
+            ), stamped AS (
+                UPDATE appeals a SET
+                    last_admin_msg_at = CASE WHEN $2 = 'admin' THEN m.created_at ELSE a.last_admin_msg_at END,
+                    last_user_msg_at = CASE WHEN $2 = 'user' THEN m.created_at ELSE a.last_user_msg_at END
+                FROM m
+                WHERE a.id = $1
+            )
+            SELECT id FROM m
+        """, appeal_id, sender, text)
     finally:
         await conn.close()
 
 
-async def update_status(appeal_id, status):
-    conn = await asyncpg.connect(DB_URL)
+@instrumented
+async def change_status(appeal_id, status):
+    """Set appeal status and return (user_id, previous_status), or None if the appeal does not exist"""
+    conn = await connect()
+    try:
+        row = await conn.fetchrow("""
+            UPDATE appeals a SET status=$1
+            FROM (SELECT id, status FROM appeals WHERE id=$2 FOR UPDATE) prev
+            WHERE a.id = prev.id
+            RETURNING a.user_id, prev.status AS previous_status
+        """, status, appeal_id)
+    finally:
+        await conn.close()
+    return row
+
+
+@instrumented
+async def init_outbox(conn):
+    """Dedup key on the guest message outbox so repeated notices collapse into one row"""
+    await conn.execute("ALTER TABLE pending_admin_messages ADD COLUMN IF NOT EXISTS dedup_key TEXT;")
+    await conn.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_pending_admin_messages_dedup
+    ON pending_admin_messages(dedup_key) WHERE dedup_key IS NOT NULL;
+    """)
+
+
+@instrumented
+async def change_status_and_notify(appeal_id, status, message):
+    """Set appeal status and queue the guest notice in a single statement
+
+    The notice is keyed by appeal, status and minute, so repeated clicks within the same minute
+    queue it only once. Returns (user_id, previous_status), or None if the appeal does not exist.
+    """
+    conn = await connect()
     try:
-        await conn.execute("UPDATE appeals SET status=$1 WHERE id=$2", status, appeal_id)
-        row = await conn.fetchrow("SELECT user_id FROM appeals WHERE id=$1", appeal_id)
+        row = await conn.fetchrow("""
+            WITH prev AS (
+                SELECT id, status FROM appeals WHERE id=$2 FOR UPDATE
+            ), changed AS (
+                UPDATE appeals a SET status=$1
+                FROM prev
+                WHERE a.id = prev.id
+                RETURNING a.id, a.user_id, prev.status AS previous_status
+            ), queued AS (
+                INSERT INTO pending_admin_messages (user_id, message, appeal_id, dedup_key)
+                SELECT user_id, $3, id,
+                       'status:' || id || ':' || $1 || ':' || floor(extract(epoch FROM now()) / 60)::bigint
+                FROM changed
+                -- Imported appeals may have no guest to notify
+                WHERE user_id IS NOT NULL
+                ON CONFLICT (dedup_key) WHERE dedup_key IS NOT NULL DO NOTHING
+            )
+            SELECT user_id, previous_status FROM changed
+        """, status, appeal_id, message)
     finally:
         await conn.close()
+    return row
+
+
+@instrumented
+async def update_status(appeal_id, status):
+    row = await change_status(appeal_id, status)
     return row["user_id"] if row else None
 
 
-async def get_appeals(status=None, limit=50, offset=0, room=None, search_query=None, request_type=None):
-    conn = await asyncpg.connect(DB_URL)
-    try:
-        conditions = []
-        params = []
-        param_counter = 1
-        
-        if status:
-            conditions.append(f"status=${param_counter}")
-            params.append(status)
-            param_counter += 1
-            
-        if room:
-            conditions.append(f"room=${param_counter}")
-            params.append(room)
-            param_counter += 1
-            
-        if request_type:
-            conditions.append(f"request_type=${param_counter}")
-            params.append(request_type)
-            param_counter += 1
-            
-        if search_query:
-            conditions.append(f"(text ILIKE ${param_counter} OR username ILIKE ${param_counter})")
-            params.append(f"%{search_query}%")
-            param_counter += 1
-        
-        where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
-        
-        query = f"SELECT * FROM appeals {where_clause} ORDER BY created_at DESC LIMIT ${param_counter} OFFSET ${param_counter + 1}"
-        params.extend([limit, offset])
-        
-        rows = await conn.fetch(query, *params)
-        
-        count_query = f"SELECT COUNT(*) FROM appeals {where_clause}"
-        count_params = params[:-2] if conditions else []
-        total_count = await conn.fetchval(count_query, *count_params) if count_params else await conn.fetchval("SELECT COUNT(*) FROM appeals")
-        
+def _appeal_filters(status=None, room=None, search_query=None, request_type=None, created_from=None, created_to=None,
+                    awaiting=None):
+    """WHERE clause and params for the appeal list filters"""
+    conditions = []
+    params = []
+
+    if status:
+        params.append(status)
+        conditions.append(f"status=${len(params)}")
+
+    if room:
+        params.append(room)
+        conditions.append(f"room=${len(params)}")
+
+    if request_type:
+        params.append(request_type)
+        conditions.append(f"request_type=${len(params)}")
+
+    if search_query:
+        params.append(f"%{search_query}%")
+        conditions.append(f"(text ILIKE ${len(params)} OR username ILIKE ${len(params)})")
+
+    if created_from:
+        params.append(created_from)
+        conditions.append(f"created_at >= ${len(params)}")
+
+    if created_to:
+        params.append(created_to)
+        conditions.append(f"created_at < ${len(params)}")
+
+    if awaiting in AWAITING_FILTERS:
+        conditions.append(AWAITING_FILTERS[awaiting])
+
+    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return where_clause, params
+
+
+async def _fetch(method, query, *args):
+    # One statement on its own pooled connection, so independent reads can run side by side
+    conn = await connect()
+    try:
+        return await getattr(conn, method)(query, *args)
     finally:
         await conn.close()
+
+
+APPEAL_FIELDS = (
+    'id', 'user_id', 'username', 'room', 'text', 'request_type', 'optional_comment', 'status', 'priority',
+    'assigned_admin', 'created_at', 'updated_at', 'last_admin_msg_at', 'last_user_msg_at'
+)
+# What the appeal list pages render; the detail page still reads the whole row
+APPEAL_LIST_COLUMNS = (
+    'id', 'username', 'room', 'text', 'request_type', 'status', 'priority', 'assigned_admin', 'created_at', 'updated_at'
+)
+
+
+@instrumented
+async def get_appeals(status=None, limit=50, offset=0, room=None, search_query=None, request_type=None, awaiting=None,
+                      columns=APPEAL_LIST_COLUMNS):
+    unknown = [column for column in columns if column not in APPEAL_FIELDS]
+    if unknown or not columns:
+        raise ValueError(f"Unknown appeal columns: {', '.join(unknown)}")
+    where_clause, params = _appeal_filters(status, room, search_query, request_type, awaiting=awaiting)
+    param_counter = len(params) + 1
+
+    query = (f"SELECT {', '.join(columns)} FROM appeals {where_clause} "
+             f"ORDER BY created_at DESC LIMIT ${param_counter} OFFSET ${param_counter + 1}")
+    rows, total_count = await asyncio.gather(
+        _fetch('fetch', query, *params, limit, offset),
+        _fetch('fetchval', f"SELECT COUNT(*) FROM appeals {where_clause}", *params)
+    )
     return rows, total_count
 
 
-async def get_appeal_with_messages(appeal_id):
-    conn = await asyncpg.connect(DB_URL)
+EXPORT_APPEAL_COLUMNS = (
+    'id', 'user_id', 'username', 'room', 'request_type', 'status', 'priority',
+    'assigned_admin', 'text', 'optional_comment', 'created_at', 'updated_at'
+)
+EXPORT_MESSAGE_COLUMNS = ('message_id', 'message_sender', 'message_text', 'message_created_at')
+
+
+async def iter_appeals_export(status=None, room=None, search_query=None, request_type=None,
+                              created_from=None, created_to=None, awaiting=None, messages=None, prefetch=1000):
+    """Stream appeals for export through a server-side cursor
+
+    messages=None yields appeal rows only; 'rows' adds one row per message (appeals without
+    messages appear once with empty message columns); 'nested' adds a JSON array of the
+    appeal's messages. Only `prefetch` rows are held in memory at a time.
+    """
+    where_clause, params = _appeal_filters(status, room, search_query, request_type, created_from, created_to, awaiting)
+    columns = ", ".join(f"a.{column}" for column in EXPORT_APPEAL_COLUMNS)
+
+    if messages == 'rows':
+        query = f"""
+            SELECT {columns}, m.id AS message_id, m.sender AS message_sender,
+                   m.text AS message_text, m.created_at AS message_created_at
+            FROM (SELECT * FROM appeals {where_clause}) a
+            LEFT JOIN messages m ON m.appeal_id = a.id
+            ORDER BY a.created_at, a.id, m.created_at, m.id
+        """
+    elif messages == 'nested':
+        query = f"""
+            SELECT {columns},
+                   COALESCE((SELECT json_agg(json_build_object(
+                                'id', m.id, 'sender', m.sender, 'text', m.text, 'created_at', m.created_at
+                             ) ORDER BY m.created_at, m.id)
+                             FROM messages m WHERE m.appeal_id = a.id), '[]') AS messages
+            FROM appeals a {where_clause}
+            ORDER BY a.created_at, a.id
+        """
+    else:
+        query = f"SELECT {columns} FROM appeals a {where_clause} ORDER BY a.created_at, a.id"
+
+    conn = await connect('iter_appeals_export')
+    try:
+        # Server-side cursors only live inside a transaction
+        async with conn.transaction(readonly=True, isolation='repeatable_read'):
+            async for row in conn.cursor(query, *params, prefetch=prefetch):
+                yield row
+    finally:
+        await conn.close()
+
+
+MESSAGE_PAGE_SIZE = 50
+
+
+async def _fetch_messages_page(conn, appeal_id, limit, before_id=None):
+    # Keyset pagination over (created_at, id), newest first, one extra row to tell if older ones exist
+    rows = await conn.fetch("""
+        SELECT * FROM messages
+        WHERE appeal_id = $1
+          AND ($2::int IS NULL OR (created_at, id) < (SELECT created_at, id FROM messages WHERE id = $2))
+        ORDER BY created_at DESC, id DESC
+        LIMIT $3
+    """, appeal_id, before_id, limit + 1)
+    return list(reversed(rows[:limit])), len(rows) > limit
+
+
+@instrumented
+async def get_appeal_with_messages(appeal_id, limit=MESSAGE_PAGE_SIZE):
+    """Appeal with its newest `limit` messages (oldest first), whether older ones exist, and the total count"""
+    conn = await connect()
     try:
         appeal = await conn.fetchrow("SELECT * FROM appeals WHERE id=$1", appeal_id)
-        messages = await conn.fetch("SELECT * FROM messages WHERE appeal_id=$1 ORDER BY created_at ASC", appeal_id)
+        messages, has_more = await _fetch_messages_page(conn, appeal_id, limit)
+        message_count = await conn.fetchval("SELECT COUNT(*) FROM messages WHERE appeal_id=$1", appeal_id) if has_more else len(messages)
+    finally:
+        await conn.close()
+    return appeal, messages, has_more, message_count
+
+
+@instrumented
+async def get_messages_before(appeal_id, before_id, limit=MESSAGE_PAGE_SIZE):
+    """Messages older than message `before_id` (oldest first) and whether even older ones exist"""
+    conn = await connect()
+    try:
+        return await _fetch_messages_page(conn, appeal_id, limit, before_id)
     finally:
         await conn.close()
-    return appeal, messages
 
 
+@instrumented
 async def add_admin(user_id, username, role='admin'):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         await conn.execute(
             "INSERT INTO admins (user_id, username, role) VALUES ($1, $2, $3) ON CONFLICT (user_id) DO UPDATE SET username=$2, role=$3, is_active=true",
@@ -211,16 +490,18 @@ async def add_admin(user_id, username, role='admin'):
         await conn.close()
 
 
+@instrumented
 async def remove_admin(user_id):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         await conn.execute("UPDATE admins SET is_active=false WHERE user_id=$1", user_id)
     finally:
         await conn.close()
 
 
+@instrumented
 async def is_admin(user_id):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         row = await conn.fetchrow("SELECT * FROM admins WHERE user_id=$1 AND is_active=true", user_id)
     finally:
@@ -228,8 +509,9 @@ async def is_admin(user_id):
     return row is not None
 
 
+@instrumented
 async def get_all_admins():
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         rows = await conn.fetch("SELECT * FROM admins WHERE is_active=true ORDER BY created_at")
     finally:
@@ -237,64 +519,55 @@ async def get_all_admins():
     return rows
 
 
+@instrumented
 async def get_appeals_stats():
-    conn = await asyncpg.connect(DB_URL)
-    try:
-        total = await conn.fetchval("SELECT COUNT(*) FROM appeals")
-        new_count = await conn.fetchval("SELECT COUNT(*) FROM appeals WHERE status='new'")
-        received_count = await conn.fetchval("SELECT COUNT(*) FROM appeals WHERE status='received'")
-        done_count = await conn.fetchval("SELECT COUNT(*) FROM appeals WHERE status='done'")
-        declined_count = await conn.fetchval("SELECT COUNT(*) FROM appeals WHERE status='declined'")
-        
-        daily_stats = await conn.fetch("""
+    counts, daily_stats, room_stats, type_stats, hourly_stats, avg_response_time = await asyncio.gather(
+        _fetch('fetchrow', """
+            SELECT COUNT(*) AS total,
+                   COUNT(*) FILTER (WHERE status='new') AS new,
+                   COUNT(*) FILTER (WHERE status='received') AS received,
+                   COUNT(*) FILTER (WHERE status='done') AS done,
+                   COUNT(*) FILTER (WHERE status='declined') AS declined,
+                   COUNT(*) FILTER (WHERE DATE(created_at) = CURRENT_DATE) AS today,
+                   COUNT(*) FILTER (WHERE DATE(created_at) = CURRENT_DATE - INTERVAL '1 day') AS yesterday
+            FROM appeals
+        """),
+        _fetch('fetch', """
             SELECT DATE(created_at) as date, COUNT(*) as count 
             FROM appeals 
             WHERE created_at >= NOW() - INTERVAL '7 days' 
             GROUP BY DATE(created_at) 
             ORDER BY date ASC
-        """)
-        
-        room_stats = await conn.fetch("""
+        """),
+        _fetch('fetch', """
             SELECT room, COUNT(*) as count 
             FROM appeals 
             GROUP BY room 
             ORDER BY count DESC 
             LIMIT 10
-        """)
-        
-        type_stats = await conn.fetch("""
+        """),
+        _fetch('fetch', """
             SELECT request_type, COUNT(*) as count 
             FROM appeals 
             GROUP BY request_type 
             ORDER BY count DESC
-        """)
-        
-        hourly_stats = await conn.fetch("""
+        """),
+        _fetch('fetch', """
             SELECT EXTRACT(HOUR FROM created_at) as hour, COUNT(*) as count
             FROM appeals
             WHERE created_at >= NOW() - INTERVAL '24 hours'
             GROUP BY hour
             ORDER BY hour
-        """)
-        
-        avg_response_time = await conn.fetchval("""
+        """),
+        _fetch('fetchval', """
             SELECT AVG(EXTRACT(EPOCH FROM (updated_at - created_at))) / 3600
             FROM appeals
             WHERE status != 'new' AND updated_at IS NOT NULL
         """)
-        
-        today_count = await conn.fetchval("""
-            SELECT COUNT(*) FROM appeals 
-            WHERE DATE(created_at) = CURRENT_DATE
-        """)
-        
-        yesterday_count = await conn.fetchval("""
-            SELECT COUNT(*) FROM appeals 
-            WHERE DATE(created_at) = CURRENT_DATE - INTERVAL '1 day'
-        """)
-        
-    finally:
-        await conn.close()
+    )
+    total = counts['total']
+    new_count, received_count, done_count, declined_count = counts['new'], counts['received'], counts['done'], counts['declined']
+    today_count, yesterday_count = counts['today'], counts['yesterday']
     
     return {
         'total': total,
@@ -313,8 +586,45 @@ async def get_appeals_stats():
     }
 
 
+@instrumented
+async def get_appeal_summary(appeal_id):
+    """Columns needed to route or escalate an appeal, without its messages"""
+    conn = await connect()
+    try:
+        return await conn.fetchrow(
+            "SELECT id, room, text, request_type, status, assigned_admin, created_at FROM appeals WHERE id=$1",
+            appeal_id
+        )
+    finally:
+        await conn.close()
+
+
+@instrumented
+async def get_new_appeals_for_sla():
+    """Appeals still waiting in 'new'; read once at startup to (re)build the escalation schedule"""
+    conn = await connect()
+    try:
+        return await conn.fetch("SELECT id, request_type, created_at FROM appeals WHERE status='new'")
+    finally:
+        await conn.close()
+
+
+@instrumented
+async def get_open_assignments(statuses):
+    """Assigned appeals in the given statuses; the assignment engine rebuilds its load counters from them"""
+    conn = await connect()
+    try:
+        return await conn.fetch(
+            "SELECT id, assigned_admin FROM appeals WHERE status = ANY($1::text[]) AND assigned_admin IS NOT NULL",
+            list(statuses)
+        )
+    finally:
+        await conn.close()
+
+
+@instrumented
 async def assign_appeal_to_admin(appeal_id, admin_id):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         await conn.execute(
             "UPDATE appeals SET assigned_admin=$1, updated_at=NOW() WHERE id=$2", 
@@ -324,77 +634,183 @@ async def assign_appeal_to_admin(appeal_id, admin_id):
         await conn.close()
 
 
+@instrumented
 async def bulk_update_status(appeal_ids, status):
-    conn = await asyncpg.connect(DB_URL)
+    """Set status on many appeals; returns how many of them were in each previous status"""
+    conn = await connect()
+    try:
+        rows = await conn.fetch("""
+            UPDATE appeals a SET status=$1, updated_at=NOW()
+            FROM (SELECT id, status FROM appeals WHERE id = ANY($2) FOR UPDATE) prev
+            WHERE a.id = prev.id
+            RETURNING prev.status AS previous_status
+        """, status, appeal_ids)
+    finally:
+        await conn.close()
+
+    previous = {}
+    for row in rows:
+        previous[row['previous_status']] = previous.get(row['previous_status'], 0) + 1
+    return previous
+
+
+BULK_JOB_LEASE = timedelta(minutes=1)
+
+
+@instrumented
+async def create_bulk_job(appeal_ids, status, message, admin=None):
+    """Record a bulk status change to be applied in chunks; returns the job row"""
+    conn = await connect()
+    try:
+        return await conn.fetchrow("""
+            INSERT INTO bulk_jobs (status, appeal_ids, message, total, admin)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING *
+        """, status, appeal_ids, message, len(appeal_ids), admin)
+    finally:
+        await conn.close()
+
+
+@instrumented
+async def get_bulk_job(job_id):
+    conn = await connect()
+    try:
+        return await conn.fetchrow("SELECT * FROM bulk_jobs WHERE id=$1", job_id)
+    finally:
+        await conn.close()
+
+
+@instrumented
+async def claim_bulk_jobs(job_id=None):
+    """Take the lease on running jobs nobody is processing (or on one job); returns the claimed rows"""
+    conn = await connect()
+    try:
+        return await conn.fetch("""
+            UPDATE bulk_jobs SET locked_until = NOW() + $1::interval, updated_at = NOW()
+            WHERE state = 'running'
+              AND (locked_until IS NULL OR locked_until < NOW())
+              AND ($2::int IS NULL OR id = $2)
+            RETURNING *
+        """, BULK_JOB_LEASE, job_id)
+    finally:
+        await conn.close()
+
+
+@instrumented
+async def run_bulk_job_chunk(job_id, chunk_size=500):
+    """Apply the next chunk of a bulk job in one transaction
+
+    Updates the appeals, queues guest notices for those whose status actually changed (same
+    dedup key as the single-appeal path) and advances the job's progress together, so an
+    interrupted job resumes exactly after the last committed chunk.
+    Returns (job row, {previous_status: count}).
+    """
+    conn = await connect()
+    try:
+        async with conn.transaction():
+            job = await conn.fetchrow("SELECT * FROM bulk_jobs WHERE id=$1 FOR UPDATE", job_id)
+            if not job or job['state'] != 'running':
+                return job, {}
+
+            chunk = job['appeal_ids'][job['processed']:job['processed'] + chunk_size]
+            rows = await conn.fetch("""
+                WITH prev AS (
+                    SELECT id, status FROM appeals WHERE id = ANY($2) ORDER BY id FOR UPDATE
+                ), changed AS (
+                    UPDATE appeals a SET status=$1, updated_at=NOW()
+                    FROM prev
+                    WHERE a.id = prev.id
+                    RETURNING a.id, a.user_id, prev.status AS previous_status
+                ), queued AS (
+                    INSERT INTO pending_admin_messages (user_id, message, appeal_id, dedup_key)
+                    SELECT user_id, $3, id,
+                           'status:' || id || ':' || $1 || ':' || floor(extract(epoch FROM now()) / 60)::bigint
+                    FROM changed
+                    WHERE $3::text IS NOT NULL AND user_id IS NOT NULL AND previous_status IS DISTINCT FROM $1
+                    ON CONFLICT (dedup_key) WHERE dedup_key IS NOT NULL DO NOTHING
+                )
+                SELECT previous_status FROM changed
+            """, job['status'], chunk, job['message'])
+
+            processed = job['processed'] + len(chunk)
+            job = await conn.fetchrow("""
+                UPDATE bulk_jobs SET processed = $2,
+                    state = CASE WHEN $2 >= total THEN 'done' ELSE state END,
+                    locked_until = NOW() + $3::interval, updated_at = NOW()
+                WHERE id = $1
+                RETURNING *
+            """, job_id, processed, BULK_JOB_LEASE)
+    finally:
+        await conn.close()
+
+    previous = {}
+    for row in rows:
+        previous[row['previous_status']] = previous.get(row['previous_status'], 0) + 1
+    return job, previous
+
+
+@instrumented
+async def fail_bulk_job(job_id, error):
+    conn = await connect()
     try:
         await conn.execute(
-            "UPDATE appeals SET status=$1, updated_at=NOW() WHERE id = ANY($2)", 
-            status, appeal_ids
+            "UPDATE bulk_jobs SET state='failed', error=$2, locked_until=NULL, updated_at=NOW() WHERE id=$1",
+            job_id, error
         )
     finally:
         await conn.close()
 
 
+@instrumented
 async def can_user_reply(appeal_id, user_id):
-    conn = await asyncpg.connect(DB_URL)
-    try:
-        appeal = await conn.fetchrow("SELECT user_id FROM appeals WHERE id=$1", appeal_id)
-        if not appeal or appeal['user_id'] != user_id:
-            return False
-        
-        last_admin_msg = await conn.fetchrow(
-            "SELECT id FROM messages WHERE appeal_id=$1 AND sender='admin' ORDER BY created_at DESC LIMIT 1", 
-            appeal_id
-        )
-        if not last_admin_msg:
-            return False
-        
-        user_reply_after_admin = await conn.fetchrow(
-            "SELECT id FROM messages WHERE appeal_id=$1 AND sender='user' AND created_at > (SELECT created_at FROM messages WHERE id=$2)",
-            appeal_id, last_admin_msg['id']
-        )
-        
-        return user_reply_after_admin is None
-        
+    """The guest may reply when it is their appeal and the admin spoke last"""
+    conn = await connect()
+    try:
+        allowed = await conn.fetchval(f"""
+            SELECT user_id = $2 AND {AWAITING_FILTERS['guest']}
+            FROM appeals WHERE id = $1
+        """, appeal_id, user_id)
+        return bool(allowed)
     finally:
         await conn.close()
 
 
+@instrumented
 async def get_appeals_by_type():
-    conn = await asyncpg.connect(DB_URL)
-    try:
-        type_groups = {}
-        
-        type_names = {
-            'iron': 'Утюг и гладильная доска',
-            'laundry': 'Услуги прачечной',
-            'technical_ac': 'Кондиционер',
-            'technical_wifi': 'WiFi',
-            'technical_tv': 'Телевизор',
-            'technical_other': 'Другие технические проблемы',
-            'restaurant_call': 'Соединить с рестораном',
-            'custom': 'Другие вопросы',
-            'other': 'Прочее'
-        }
-        
-        for req_type, display_name in type_names.items():
-            appeals = await conn.fetch("""
-                SELECT * FROM appeals 
-                WHERE request_type = $1 
-                ORDER BY created_at DESC
-            """, req_type)
-            
-            if appeals:
-                type_groups[display_name] = [dict(appeal) for appeal in appeals]
-    
-    finally:
-        await conn.close()
-    
+    type_names = {
+        'iron': 'Утюг и гладильная доска',
+        'laundry': 'Услуги прачечной',
+        'technical_ac': 'Кондиционер',
+        'technical_wifi': 'WiFi',
+        'technical_tv': 'Телевизор',
+        'technical_other': 'Другие технические проблемы',
+        'restaurant_call': 'Соединить с рестораном',
+        'custom': 'Другие вопросы',
+        'other': 'Прочее'
+    }
+
+    # One query instead of one per type; groups keep the type_names order
+    appeals = await _fetch('fetch', """
+        SELECT * FROM appeals 
+        WHERE request_type = ANY($1::text[]) 
+        ORDER BY created_at DESC
+    """, list(type_names))
+
+    by_type = {}
+    for appeal in appeals:
+        by_type.setdefault(appeal['request_type'], []).append(dict(appeal))
+
+    type_groups = {}
+    for req_type, display_name in type_names.items():
+        if req_type in by_type:
+            type_groups[display_name] = by_type[req_type]
+
     return type_groups
 
 
+@instrumented
 async def add_notification_recipient(chat_id, username=None):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         await conn.execute(
             """INSERT INTO notification_settings (chat_id, username) 
@@ -406,8 +822,9 @@ async def add_notification_recipient(chat_id, username=None):
         await conn.close()
 
 
+@instrumented
 async def remove_notification_recipient(chat_id):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         await conn.execute(
             "DELETE FROM notification_settings WHERE chat_id=$1",
@@ -417,24 +834,26 @@ async def remove_notification_recipient(chat_id):
         await conn.close()
 
 
+@instrumented
 async def get_notification_recipients(active_only=True):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         if active_only:
             rows = await conn.fetch(
-                "SELECT * FROM notification_settings WHERE is_active=true ORDER BY created_at"
+                "SELECT chat_id, username, is_active, created_at FROM notification_settings WHERE is_active=true ORDER BY created_at"
             )
         else:
             rows = await conn.fetch(
-                "SELECT * FROM notification_settings ORDER BY created_at"
+                "SELECT chat_id, username, is_active, created_at FROM notification_settings ORDER BY created_at"
             )
     finally:
         await conn.close()
     return rows
 
 
+@instrumented
 async def toggle_notification_recipient(chat_id, is_active):
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         await conn.execute(
             "UPDATE notification_settings SET is_active=$1 WHERE chat_id=$2",
@@ -444,12 +863,19 @@ async def toggle_notification_recipient(chat_id, is_active):
         await conn.close()
 
 
+@instrumented
 async def init_settings():
     """Initialize default settings"""
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         settings = [
             ('timezone', 'Europe/Moscow', 'Часовой пояс для отображения времени'),
+            ('sla_default', '15', 'Время реакции на новое обращение, мин (если для типа не задано своё)'),
+            ('sla_restaurant_call', '5', 'Время реакции: соединить с рестораном, мин'),
+            ('sla_technical_ac', '30', 'Время реакции: кондиционер, мин'),
+            ('sla_technical_other', '30', 'Время реакции: другие технические проблемы, мин'),
+            ('sla_laundry', '30', 'Время реакции: прачечная, мин'),
+            ('assign_policy_default', 'least_loaded', 'Назначение заявок: least_loaded, round_robin или off'),
         ]
 
         for key, value, description in settings:
@@ -463,9 +889,10 @@ async def init_settings():
         await conn.close()
 
 
+@instrumented
 async def get_setting(key):
     """Get setting value by key"""
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         row = await conn.fetchrow("SELECT value FROM settings WHERE key=$1", key)
         return row['value'] if row else None
@@ -473,9 +900,10 @@ async def get_setting(key):
         await conn.close()
 
 
+@instrumented
 async def update_setting(key, value):
     """Update setting value"""
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         await conn.execute("""
             UPDATE settings
@@ -486,11 +914,12 @@ async def update_setting(key, value):
         await conn.close()
 
 
+@instrumented
 async def get_all_settings():
     """Get all settings"""
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
-        rows = await conn.fetch("SELECT * FROM settings ORDER BY key")
+        rows = await conn.fetch("SELECT key, value, description, updated_at FROM settings ORDER BY key")
         return rows
     finally:
         await conn.close()
@@ -521,8 +950,9 @@ def format_time_for_display(dt):
         return dt.strftime('%d.%m.%Y %H:%M') if hasattr(dt, 'strftime') else str(dt)
 
 
+@instrumented
 async def init_message_templates():
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         templates = [
             ('welcome_text', """
@@ -678,7 +1108,15 @@ async def init_message_templates():
 
 🔔 Обращение #{appeal_id}
 
-🕗 Время: {time}""", 'Уведомление о новом сообщении пользователя')
+🕗 Время: {time}""", 'Уведомление о новом сообщении пользователя'),
+
+            ('sla_escalation_notification', """⏰ <b>Заявка #{appeal_id} без ответа {minutes} мин</b>
+
+🛏️ Комната: <b>{room}</b>
+📋 Тип: {service_name}
+✉️ Описание: {description}
+
+⚠️ Уровень эскалации: {tier}""", 'Напоминание о заявке, которую не взяли в работу вовремя')
         ]
 
         for key, text, description in templates:
@@ -692,9 +1130,10 @@ async def init_message_templates():
         await conn.close()
 
 
+@instrumented
 async def get_message_template(key):
     """Get message template by key"""
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         row = await conn.fetchrow("SELECT text FROM message_templates WHERE key=$1", key)
         return row['text'] if row else None
@@ -702,19 +1141,21 @@ async def get_message_template(key):
         await conn.close()
 
 
+@instrumented
 async def get_all_message_templates():
     """Get all message templates"""
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
-        rows = await conn.fetch("SELECT * FROM message_templates ORDER BY key")
+        rows = await conn.fetch("SELECT key, text, description, updated_at FROM message_templates ORDER BY key")
         return rows
     finally:
         await conn.close()
 
 
+@instrumented
 async def update_message_template(key, text):
     """Update message template"""
-    conn = await asyncpg.connect(DB_URL)
+    conn = await connect()
     try:
         await conn.execute("""
             UPDATE message_templates
@@ -723,3 +1164,90 @@ async def update_message_template(key, text):
         """, text, key)
     finally:
         await conn.close()
+
+
+@instrumented
+async def init_service_catalog():
+    """Seed the default service catalog used to build the bot menus"""
+    conn = await connect()
+    try:
+        # (key, parent, kind, request_type, label_key, label, title_key, title, row_num, position)
+        catalog = [
+            ('main', '', 'menu', None, None, None, 'service_menu_title', 'Выберите услугу:', 0, 0),
+
+            ('service_iron', 'main', 'request', 'iron', 'service_iron', '🧹 Нужен утюг и гладильная доска', None, None, 0, 0),
+            ('service_laundry', 'main', 'request', 'laundry', 'service_laundry', '👕 Услуги прачечной', None, None, 1, 0),
+            ('service_technical', 'main', 'menu', None, None, '🔧 Техническая проблема в номере', 'service_technical', 'Выберите тип технической проблемы:', 2, 0),
+            ('service_restaurant', 'main', 'menu', None, None, '🍽 Услуги ресторана', 'service_restaurant', 'Выберите услугу ресторана:', 3, 0),
+            ('service_other', 'main', 'action', None, 'service_other', '❓ Другой вопрос', None, None, 4, 0),
+            ('menu_contacts', 'main', 'action', None, 'menu_contacts', '📞 Контакты', None, None, 5, 0),
+            ('back_main_menu', 'main', 'action', None, 'back_main_menu', '🏠 Назад в главное меню', None, None, 5, 1),
+
+            ('tech_ac', 'service_technical', 'request', 'technical_ac', 'tech_ac', '❄️ Кондиционер', None, None, 0, 0),
+            ('tech_wifi', 'service_technical', 'request', 'technical_wifi', 'tech_wifi', '📶 WiFi', None, None, 1, 0),
+            ('tech_tv', 'service_technical', 'request', 'technical_tv', 'tech_tv', '📺 Телевизор', None, None, 2, 0),
+            ('tech_other', 'service_technical', 'action', 'technical_other', 'tech_other', '🔧 Другое', None, None, 3, 0),
+            ('back_services', 'service_technical', 'action', None, 'back_services', '🔙 Назад', None, None, 4, 0),
+
+            ('menu_room_service', 'service_restaurant', 'action', None, 'menu_room_service', '📋 Меню рум-сервис', None, None, 0, 0),
+            ('menu_restaurant', 'service_restaurant', 'action', None, 'menu_restaurant', '🍽 Меню ресторана', None, None, 1, 0),
+            ('connect_restaurant', 'service_restaurant', 'request', 'restaurant_call', 'connect_restaurant', '📞 Соедините с рестораном', None, None, 2, 0),
+            ('back_services', 'service_restaurant', 'action', None, 'back_services', '🔙 Назад', None, None, 3, 0),
+        ]
+
+        await conn.executemany("""
+            INSERT INTO service_catalog (key, parent, kind, request_type, label_key, label, title_key, title, row_num, position)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+            ON CONFLICT (parent, key) DO NOTHING
+        """, catalog)
+
+    finally:
+        await conn.close()
+
+
+@instrumented
+async def get_service_catalog():
+    """Get active service catalog entries in menu order"""
+    conn = await connect()
+    try:
+        rows = await conn.fetch("""
+            SELECT * FROM service_catalog
+            WHERE is_active=true
+            ORDER BY parent, row_num, position, id
+        """)
+        return rows
+    finally:
+        await conn.close()
+
+
+@instrumented
+async def get_service_catalog_version():
+    """Get a cheap stamp that changes whenever the catalog or message templates change"""
+    conn = await connect()
+    try:
+        row = await conn.fetchrow("""
+            SELECT
+                (SELECT MAX(updated_at) FROM message_templates) AS templates_updated,
+                (SELECT COUNT(*) FROM message_templates) AS templates_count,
+                (SELECT MAX(updated_at) FROM service_catalog) AS catalog_updated,
+                (SELECT COUNT(*) FROM service_catalog WHERE is_active=true) AS catalog_count
+        """)
+        return tuple(row)
+    finally:
+        await conn.close()
+
+
+@instrumented
+async def get_table_versions(conn=None):
+    """Current change counter of every versioned table"""
+    own_conn = conn is None
+    if own_conn:
+        conn = await connect()
+    try:
+        versions = {}
+        for table in VERSIONED_TABLES:
+            versions[table] = await conn.fetchval(f"SELECT last_value FROM {table}_version_seq")
+        return versions
+    finally:
+        if own_conn:
+            await conn.close()
@@ -0,0 +1,192 @@
+"""Connection pool plus timing and attribution for every statement sent through it
+
+connect() hands out a pooled connection whose close() returns it to the pool. Each query is
+reported to Prometheus, labelled with the db.db function that issued it (set by @instrumented)
+or with the label passed to connect().
+Statements slower than SLOW_QUERY_MS are logged together with their EXPLAIN plan.
+Wrap a web request or bot update in track_unit() to count its round trips.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+import asyncpg
+from prometheus_client import Counter, Histogram
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DB_URL
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+# Plans of the same statement are logged at most once per this many seconds
+EXPLAIN_INTERVAL = 300
+
+DB_QUERY_SECONDS = Histogram(
+    'db_query_duration_seconds', 'Time per SQL statement', ['function'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+DB_QUERY_ERRORS = Counter('db_query_errors_total', 'SQL statements that raised', ['function'])
+DB_SLOW_QUERIES = Counter('db_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS', ['function'])
+DB_CONNECTIONS = Counter('db_connections_acquired_total', 'Connections taken from the pool', ['function'])
+DB_POOL_WAIT_SECONDS = Histogram(
+    'db_pool_acquire_seconds', 'Time waiting for a pooled connection',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+DB_FUNCTION_SECONDS = Histogram(
+    'db_function_duration_seconds', 'Time per db.db function call, including connecting', ['function'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+DB_ROUND_TRIPS = Histogram(
+    'db_round_trips_per_unit', 'SQL statements per web request or bot update', ['source', 'name'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+)
+
+current_function = contextvars.ContextVar('db_current_function', default=None)
+current_unit = contextvars.ContextVar('db_current_unit', default=None)
+
+_explained_at = {}
+
+_pool = None
+_pool_lock = None
+
+
+class UnitStats:
+    """Queries issued while handling one web request or bot update"""
+
+    def __init__(self, name, keep_statements=False):
+        self.name = name
+        self.queries = 0
+        self.connections = 0
+        self.seconds = 0.0
+        self.statements = [] if keep_statements else None
+
+
+class PooledConnection:
+    """Pooled asyncpg connection; close() gives it back to the pool instead of closing it"""
+
+    def __init__(self, pool, conn, label):
+        self._pool = pool
+        self._conn = conn
+        # Attached only while checked out, so the reset statement the pool runs on release is not counted
+        self._query_logger = functools.partial(_log_query, label)
+        conn.add_query_logger(self._query_logger)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            # Statements that already finished have their logger call scheduled with the label bound
+            conn.remove_query_logger(self._query_logger)
+            await self._pool.release(conn)
+
+
+async def get_pool():
+    global _pool, _pool_lock
+    if _pool is None:
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    DB_URL, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE
+                )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+def instrumented(func):
+    """Attribute every statement run inside a db.db function to that function"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_function.set(name)
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            DB_FUNCTION_SECONDS.labels(name).observe(time.perf_counter() - started)
+            current_function.reset(token)
+    return wrapper
+
+
+async def connect(label=None):
+    """A pooled connection with query timing; label names queries made outside db.db functions"""
+    pool = await get_pool()
+    started = time.perf_counter()
+    conn = await pool.acquire()
+    DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+    DB_CONNECTIONS.labels(current_function.get() or label or 'other').inc()
+    unit = current_unit.get()
+    if unit:
+        unit.connections += 1
+    return PooledConnection(pool, conn, label or 'other')
+
+
+def _log_query(label, record):
+    # asyncpg schedules loggers with call_soon, which carries the caller's context along
+    function = current_function.get() or label
+    DB_QUERY_SECONDS.labels(function).observe(record.elapsed)
+    if record.exception is not None:
+        DB_QUERY_ERRORS.labels(function).inc()
+
+    unit = current_unit.get()
+    if unit:
+        unit.queries += 1
+        unit.seconds += record.elapsed
+        if unit.statements is not None:
+            unit.statements.append((record.query, record.args))
+
+    if record.elapsed * 1000 >= SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.labels(function).inc()
+        query = ' '.join(record.query.split())
+        logger.warning(f"Slow query in {function}: {record.elapsed * 1000:.0f} ms: {query[:500]}")
+        now = time.monotonic()
+        if record.exception is None and now - _explained_at.get(record.query, -EXPLAIN_INTERVAL) >= EXPLAIN_INTERVAL:
+            _explained_at[record.query] = now
+            asyncio.get_running_loop().create_task(_log_plan(function, record.query, record.args))
+
+
+async def _log_plan(function, query, args):
+    # Plain EXPLAIN: the statement is planned, not run again, so writes are safe to explain
+    try:
+        conn = await asyncpg.connect(DB_URL)
+        try:
+            rows = await conn.fetch(f"EXPLAIN {query}", *(args or ()))
+        finally:
+            await conn.close()
+        plan = '\n'.join(row[0] for row in rows)
+        logger.warning(f"Plan for slow query in {function}:\n{plan}")
+    except Exception as e:
+        logger.debug(f"Could not explain slow query in {function}: {e}")
+
+
+@asynccontextmanager
+async def track_unit(source, name='other', keep_statements=False):
+    """Count the statements issued while handling one request/update and record them per source and name
+
+    The name can still be changed through the yielded stats, e.g. once the route is known.
+    """
+    stats = UnitStats(name, keep_statements)
+    token = current_unit.set(stats)
+    try:
+        yield stats
+    finally:
+        # Let the query loggers of the last statements run before reading the count
+        await asyncio.sleep(0)
+        current_unit.reset(token)
+        DB_ROUND_TRIPS.labels(source, stats.name).observe(stats.queries)
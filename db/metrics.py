@@ -0,0 +1,24 @@
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+
+async def start_metrics_server(port, health_check=None, host='0.0.0.0'):
+    """Serve /metrics and /health for a non-HTTP asyncio service (bot, bridge)
+
+    health_check is an async callable returning (ok, details); /health answers 503 when ok is false.
+    """
+    async def metrics(request):
+        return web.Response(body=generate_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+    async def health(request):
+        ok, details = (True, {}) if health_check is None else await health_check()
+        return web.json_response({'status': 'ok' if ok else 'unhealthy', **details}, status=200 if ok else 503)
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/health', health)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
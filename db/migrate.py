@@ -0,0 +1,32 @@
+"""One-shot schema step: creates and upgrades tables, indexes, triggers and default rows
+
+Run once per deploy before starting the bot, bridge and web workers:
+
+    python -m db.migrate
+"""
+import asyncio
+import sys
+import os
+import asyncpg
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DB_URL
+from db.db import init_db
+from db.instrument import close_pool
+
+# Serializes concurrent runs (e.g. two deploys racing); DDL such as CREATE OR REPLACE TRIGGER is not safe to run in parallel
+MIGRATION_LOCK_ID = 72150417
+
+
+async def main():
+    lock_conn = await asyncpg.connect(DB_URL)
+    try:
+        await lock_conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        await init_db()
+        print("Database schema is up to date")
+    finally:
+        await lock_conn.close()
+        await close_pool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,262 @@
+"""Synthetic data seeder and CSV importer for appeals, messages and the guest message outbox
+
+Everything is loaded with COPY (asyncpg copy_records_to_table) in batches, so millions of rows
+take minutes rather than hours. Generated data is reproducible for a given --seed and --until.
+
+    python -m db.seed generate --appeals 1000000 --seed 42
+    python -m db.seed import appeals appeals_2024.csv
+    python -m db.seed import messages messages_2024.csv
+
+CSV files from /api/appeals/export load into appeals only; their message_* columns are ignored,
+so conversations have to be imported from a separate file with the messages table's own columns.
+"""
+import argparse
+import asyncio
+import csv
+import random
+import sys
+import os
+import time
+from datetime import datetime, timedelta
+import asyncpg
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DB_URL
+from db.db import init_db, refresh_last_message_times
+from db.instrument import close_pool
+
+REQUEST_TYPES = {
+    'iron': 14,
+    'laundry': 12,
+    'technical_ac': 10,
+    'technical_wifi': 16,
+    'technical_tv': 8,
+    'technical_other': 9,
+    'restaurant_call': 11,
+    'custom': 13,
+    'other': 7,
+}
+
+REQUEST_TEXTS = {
+    'iron': ["Нужен утюг и гладильная доска", "Принесите, пожалуйста, утюг"],
+    'laundry': ["Хочу сдать вещи в прачечную", "Нужна стирка и глажка рубашек"],
+    'technical_ac': ["Не работает кондиционер", "Кондиционер сильно шумит"],
+    'technical_wifi': ["Не подключается WiFi", "Очень медленный интернет"],
+    'technical_tv': ["Телевизор не включается", "Нет каналов на телевизоре"],
+    'technical_other': ["Не работает свет в ванной", "Протекает кран"],
+    'restaurant_call': ["Соедините с рестораном", "Хочу заказать ужин в номер"],
+    'custom': ["Можно поздний выезд?", "Нужно такси в аэропорт к 6 утра"],
+    'other': ["Вопрос по счёту", "Забыл вещи в номере"],
+}
+
+USER_REPLIES = ["Спасибо!", "Всё ещё не работает", "Когда подойдут?", "Можно побыстрее?", "Да, удобно"]
+ADMIN_REPLIES = ["Мастер уже идёт к вам", "Принято, займёмся в течение 15 минут", "Проблема решена?", "Уточните, пожалуйста, время"]
+
+# Requests cluster around the morning and the evening
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 10, 9, 7, 6, 6, 6, 5, 5, 6, 8, 10, 11, 10, 8, 5, 2]
+
+APPEAL_COLUMNS = ('id', 'user_id', 'username', 'room', 'text', 'request_type', 'optional_comment',
+                  'status', 'priority', 'created_at', 'updated_at')
+MESSAGE_COLUMNS = ('appeal_id', 'sender', 'text', 'created_at')
+OUTBOX_COLUMNS = ('user_id', 'message', 'appeal_id', 'sent', 'created_at')
+
+
+class Generator:
+    """Deterministic row generator; the same seed always produces the same dataset"""
+
+    def __init__(self, seed, until, days, messages_per_appeal, outbox_ratio):
+        self.random = random.Random(seed)
+        self.now = until
+        self.days = days
+        self.messages_per_appeal = messages_per_appeal
+        self.outbox_ratio = outbox_ratio
+        self.rooms = [f"{floor}{number:02d}" for floor in range(1, 7) for number in range(1, 31)]
+        # A few rooms (suites, long stays) generate far more requests than the rest
+        self.room_weights = [1 / (rank + 1) ** 0.6 for rank in range(len(self.rooms))]
+        self.guests = [(500000000 + i, f"guest{i}") for i in range(max(1000, days * 40))]
+
+    def created_at(self):
+        day = self.now - timedelta(days=int(self.days * self.random.random() ** 1.5) + 1)
+        hour = self.random.choices(range(24), HOUR_WEIGHTS)[0]
+        return day.replace(hour=hour, minute=self.random.randrange(60), second=self.random.randrange(60), microsecond=0)
+
+    def status(self, created_at):
+        age = self.now - created_at
+        if age < timedelta(hours=2):
+            return self.random.choices(['new', 'received', 'done'], [6, 3, 1])[0]
+        if age < timedelta(days=2):
+            return self.random.choices(['new', 'received', 'done', 'declined'], [1, 3, 10, 1])[0]
+        return self.random.choices(['done', 'declined', 'received'], [90, 8, 2])[0]
+
+    def appeal(self, appeal_id):
+        request_type = self.random.choices(list(REQUEST_TYPES), list(REQUEST_TYPES.values()))[0]
+        user_id, username = self.random.choice(self.guests)
+        created_at = self.created_at()
+        status = self.status(created_at)
+        updated_at = created_at if status == 'new' else created_at + timedelta(minutes=self.random.expovariate(1 / 40))
+        comment = self.random.choice(["Срочно", "После 18:00", "Позвоните перед приходом"]) if self.random.random() < 0.15 else None
+        return (
+            appeal_id, user_id, username,
+            self.random.choices(self.rooms, self.room_weights)[0],
+            self.random.choice(REQUEST_TEXTS[request_type]),
+            request_type, comment, status,
+            2 if self.random.random() < 0.05 else 1,
+            created_at, updated_at
+        )
+
+    def messages(self, appeal):
+        appeal_id, created_at = appeal[0], appeal[9]
+        count = int(self.random.expovariate(1 / self.messages_per_appeal)) if self.messages_per_appeal else 0
+        at = created_at
+        sender = 'admin'
+        for _ in range(count):
+            at += timedelta(minutes=self.random.expovariate(1 / 25))
+            yield (appeal_id, sender, self.random.choice(ADMIN_REPLIES if sender == 'admin' else USER_REPLIES), at)
+            sender = 'user' if sender == 'admin' else 'admin'
+
+    def outbox(self, appeal):
+        if appeal[7] == 'new' or self.random.random() >= self.outbox_ratio:
+            return None
+        appeal_id, user_id, status, updated_at = appeal[0], appeal[1], appeal[7], appeal[10]
+        # Anything older than a minute has long been delivered by the bot
+        sent = self.now - updated_at > timedelta(minutes=1)
+        return (user_id, f"📬 Ваше обращение #{appeal_id}: статус {status}", appeal_id, sent, updated_at)
+
+
+async def reserve_ids(conn, table, count):
+    return await conn.fetchval(
+        f"SELECT array_agg(nextval(pg_get_serial_sequence('{table}', 'id'))) FROM generate_series(1, $1)",
+        count
+    )
+
+
+async def generate(conn, args):
+    generator = Generator(args.seed, args.until, args.days, args.messages_per_appeal, args.outbox_ratio)
+    totals = {'appeals': 0, 'messages': 0, 'pending_admin_messages': 0}
+    started = time.perf_counter()
+
+    remaining = args.appeals
+    while remaining > 0:
+        batch = min(args.batch, remaining)
+        ids = await reserve_ids(conn, 'appeals', batch)
+        appeals = [generator.appeal(appeal_id) for appeal_id in ids]
+        messages = [message for appeal in appeals for message in generator.messages(appeal)]
+        outbox = [row for row in map(generator.outbox, appeals) if row]
+
+        async with conn.transaction():
+            await conn.copy_records_to_table('appeals', records=appeals, columns=APPEAL_COLUMNS)
+            await conn.copy_records_to_table('messages', records=messages, columns=MESSAGE_COLUMNS)
+            await conn.copy_records_to_table('pending_admin_messages', records=outbox, columns=OUTBOX_COLUMNS)
+            await refresh_last_message_times(conn, ids)
+
+        totals['appeals'] += len(appeals)
+        totals['messages'] += len(messages)
+        totals['pending_admin_messages'] += len(outbox)
+        remaining -= batch
+        elapsed = time.perf_counter() - started
+        print(f"{totals['appeals']}/{args.appeals} appeals, {totals['messages']} messages, "
+              f"{totals['pending_admin_messages']} outbox rows ({totals['appeals'] / elapsed:.0f} appeals/s)")
+
+    return totals
+
+
+def _converter(data_type):
+    if data_type in ('integer', 'bigint', 'smallint'):
+        return int
+    if data_type.startswith('timestamp'):
+        return datetime.fromisoformat
+    if data_type == 'boolean':
+        return lambda value: value.strip().lower() in ('true', 't', '1', 'yes')
+    return str
+
+
+async def import_csv(conn, args):
+    """Load a CSV file into a table; columns the table does not have are ignored, empty cells become NULL"""
+    rows = await conn.fetch(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = $1",
+        args.table
+    )
+    if not rows:
+        raise SystemExit(f"Unknown table: {args.table}")
+    types = {row['column_name']: row['data_type'] for row in rows}
+
+    # utf-8-sig also accepts the BOM written by /api/appeals/export (an appeals import)
+    with open(args.path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = [(index, name) for index, name in enumerate(header) if name in types]
+        skipped = [name for name in header if name not in types]
+        if skipped:
+            print(f"Ignoring columns not in {args.table}: {', '.join(skipped)}")
+        converters = [(index, _converter(types[name])) for index, name in columns]
+        names = [name for _, name in columns]
+
+        id_index = names.index('id') if 'id' in names else None
+
+        total = 0
+        previous_id = None
+        batch = []
+        for line in reader:
+            record = tuple(convert(line[index]) if line[index] != '' else None for index, convert in converters)
+            if id_index is not None:
+                # Exports with conversations repeat the appeal on every message row; load it once
+                if record[id_index] == previous_id:
+                    continue
+                previous_id = record[id_index]
+            batch.append(record)
+            if len(batch) >= args.batch:
+                await conn.copy_records_to_table(args.table, records=batch, columns=names)
+                total += len(batch)
+                print(f"{total} rows imported into {args.table}")
+                batch = []
+        if batch:
+            await conn.copy_records_to_table(args.table, records=batch, columns=names)
+            total += len(batch)
+
+    if args.table == 'messages':
+        await refresh_last_message_times(conn)
+    if id_index is not None:
+        # Explicit ids bypass the serial sequence; move it past the imported rows
+        await conn.execute(
+            f"SELECT setval(pg_get_serial_sequence('{args.table}', 'id'), (SELECT MAX(id) FROM {args.table}))"
+        )
+    print(f"{total} rows imported into {args.table}")
+    return {args.table: total}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=10000, help='rows per COPY')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate', help='generate synthetic appeals, messages and outbox rows')
+    generate_parser.add_argument('--appeals', type=int, default=100000)
+    generate_parser.add_argument('--messages-per-appeal', type=float, default=1.5, help='mean follow-up messages per appeal')
+    generate_parser.add_argument('--outbox-ratio', type=float, default=0.8, help='share of appeals with a guest notice')
+    generate_parser.add_argument('--days', type=int, default=365, help='spread created_at over this many days')
+    generate_parser.add_argument('--seed', type=int, default=42)
+    generate_parser.add_argument('--until', type=datetime.fromisoformat,
+                                 default=datetime.now().replace(hour=0, minute=0, second=0, microsecond=0),
+                                 help='latest created_at (default: today 00:00), fix it to reproduce a dataset exactly')
+
+    import_parser = commands.add_parser('import', help='import rows from a CSV file with a header line')
+    import_parser.add_argument('table', choices=['appeals', 'messages', 'pending_admin_messages'])
+    import_parser.add_argument('path')
+
+    args = parser.parse_args()
+
+    await init_db()
+    conn = await asyncpg.connect(DB_URL)
+    try:
+        if args.command == 'generate':
+            totals = await generate(conn, args)
+        else:
+            totals = await import_csv(conn, args)
+        for table in totals:
+            await conn.execute(f"ANALYZE {table}")
+    finally:
+        await conn.close()
+        await close_pool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+import json
+
+# Consumed by the bridge; nothing in this tree produces to them, guest messages go through the
+# pending_admin_messages outbox. Entries carry a JSON 'data' field (see add_to_stream):
+# telegram_messages {user_id, message, appeal_id?, add_reopen_button?}, status_updates {appeal_id, status, user_id}
+TELEGRAM_STREAM = 'stream:telegram_messages'
+STATUS_STREAM = 'stream:status_updates'
+ADMIN_ACTIONS_STREAM = 'stream:admin_actions'
+DEAD_LETTER_STREAM = 'stream:bridge_dead_letter'
+
+BRIDGE_GROUP = 'bridge'
+
+# Lists the bridge used to BRPOP from; drained into the streams on startup
+LEGACY_QUEUES = {
+    'telegram_messages': TELEGRAM_STREAM,
+    'status_updates': STATUS_STREAM,
+}
+
+STREAM_MAXLEN = 100000
+
+
+async def add_to_stream(redis_client, stream, payload, maxlen=STREAM_MAXLEN):
+    """Append a JSON payload to a capped stream and return the entry id"""
+    return await redis_client.xadd(stream, {'data': json.dumps(payload, default=str)}, maxlen=maxlen, approximate=True)
+
+
+async def record_admin_action(redis_client, action):
+    return await add_to_stream(redis_client, ADMIN_ACTIONS_STREAM, action, maxlen=10000)
+
+
+# Pub/sub channels every web worker subscribes to and forwards to its admin WebSockets
+ADMIN_EVENTS_CHANNEL = 'admin_events'
+ADMIN_NOTIFICATIONS_CHANNEL = 'admin_notifications'
+ADMIN_CHANNELS = (ADMIN_EVENTS_CHANNEL, ADMIN_NOTIFICATIONS_CHANNEL)
+
+
+# Appeal lifecycle events are also appended to a capped stream, so /api/events clients can resume by entry id
+APPEAL_EVENTS_STREAM = 'stream:appeal_events'
+APPEAL_EVENTS_MAXLEN = 10000
+APPEAL_EVENT_TYPES = ('new_appeal', 'status_update', 'new_message', 'bulk_update', 'sla_breach')
+
+
+async def publish_admin_event(redis_client, event, channel=ADMIN_EVENTS_CHANNEL):
+    if event.get('type') in APPEAL_EVENT_TYPES:
+        entry_id = await add_to_stream(redis_client, APPEAL_EVENTS_STREAM, event, maxlen=APPEAL_EVENTS_MAXLEN)
+        # WebSocket clients keep the latest id to catch up through /api/events after a reconnect
+        event = {**event, 'event_id': entry_id.decode() if isinstance(entry_id, bytes) else entry_id}
+    return await redis_client.publish(channel, json.dumps(event, default=str))
+
+
+def status_change(previous_status, new_status, count=1):
+    """Per-status counter changes when `count` appeals move from one status to another"""
+    if previous_status == new_status:
+        return {}
+    changes = {new_status: count}
+    if previous_status:
+        changes[previous_status] = -count
+    return changes
+
+
+def stats_delta_event(statuses=None, total=0, today_count=0, types=None):
+    """Incremental dashboard update; browsers add these numbers to the counters they already show"""
+    delta = {'statuses': {status: value for status, value in (statuses or {}).items() if value}}
+    if total:
+        delta['total'] = total
+    if today_count:
+        delta['today_count'] = today_count
+    if types:
+        delta['types'] = types
+    return {'type': 'stats_delta', 'delta': delta}
+
+
+# Generation counters for the web panel's data cache; bumping one invalidates every entry under the tag
+CACHE_GENERATION_KEY = 'cache:gen:{tag}'
+
+
+async def invalidate_cached(redis_client, *tags):
+    for tag in tags:
+        await redis_client.incr(CACHE_GENERATION_KEY.format(tag=tag))
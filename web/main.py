@@ -1,33 +1,139 @@
-from fastapi import FastAPI, Request, HTTPException, Depends, WebSocket, WebSocketDisconnect, Response
+from fastapi import FastAPI, Request, HTTPException, Depends, WebSocket, WebSocketDisconnect, Response, Body
 from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
+from email.utils import format_datetime, parsedate_to_datetime
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import secrets
+import hashlib
+import tempfile
+import csv
+import io
+import asyncio
+import time
+import random
+import threading
+from collections import Counter as StackCounter
+from decimal import Decimal
 import asyncpg
 import json
+import orjson
 import sys
 import os
 import redis.asyncio as redis
-from typing import Optional, List
+from typing import Optional, List, Dict
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
+from jinja2 import FileSystemBytecodeCache
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DB_URL, ADMIN_PASSWORD
+from config import DB_URL, ADMIN_PASSWORD, REDIS_URL, WEB_WORKERS
 from db.db import (
-    get_appeals, get_appeal_with_messages, update_status, add_message,
-    get_appeals_stats, assign_appeal_to_admin, bulk_update_status,
+    get_appeals, APPEAL_FIELDS, iter_appeals_export, EXPORT_APPEAL_COLUMNS, EXPORT_MESSAGE_COLUMNS,
+    get_appeal_with_messages, get_messages_before, change_status_and_notify, add_message,
+    get_appeals_stats, assign_appeal_to_admin, get_all_admins,
+    create_bulk_job, get_bulk_job, claim_bulk_jobs, run_bulk_job_chunk, fail_bulk_job,
     get_appeals_by_type, get_notification_recipients, add_notification_recipient,
     remove_notification_recipient, toggle_notification_recipient,
     get_message_template, get_all_message_templates, update_message_template,
     get_setting, update_setting, get_all_settings, init_settings,
-    format_time_for_display
+    format_time_for_display, get_table_versions, TABLE_VERSIONS_CHANNEL
 )
+from db.instrument import connect, track_unit, get_pool, close_pool
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest, multiprocess, CollectorRegistry, Gauge, Histogram
+from db.streams import (
+    record_admin_action, publish_admin_event, ADMIN_CHANNELS, APPEAL_EVENTS_STREAM,
+    status_change, stats_delta_event, invalidate_cached, CACHE_GENERATION_KEY
+)
+
+def _orjson_default(value):
+    if isinstance(value, asyncpg.Record):
+        return dict(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dump_json(content) -> bytes:
+    """orjson encoding; datetimes are written natively and asyncpg Records as objects"""
+    return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson; return it directly from an endpoint to also skip jsonable_encoder"""
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-worker resources: DB pool, Redis client and background listeners. Schema is created by `python -m db.migrate`."""
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+
+app = FastAPI(title="Spasskaya Hotel Admin Panel", version="3.1", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+STATIC_DIR = "static"
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "spasskaya-jinja")
+
+
+def _static_hashes(directory):
+    hashes = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:12]
+            hashes[os.path.relpath(path, directory).replace(os.sep, "/")] = digest
+    return hashes
+
+
+# Content hash of every static file, taken once per worker; assets only change with a deploy
+static_hashes = _static_hashes(STATIC_DIR)
+
 
-app = FastAPI(title="Spasskaya Hotel Admin Panel", version="3.1")
+def static_url(path):
+    """URL of a static asset that changes whenever the file's content does"""
+    path = path.lstrip("/")
+    digest = static_hashes.get(path)
+    return f"/static/{path}?v={digest}" if digest else f"/static/{path}"
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+class HashedStaticFiles(StaticFiles):
+    """Static files cached for a year when requested through static_url(), revalidated otherwise"""
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            version = parse_qs(scope.get("query_string", b"").decode()).get("v", [None])[0]
+            if version and version == static_hashes.get(path.replace(os.sep, "/")):
+                response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+            else:
+                response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+app.mount("/static", HashedStaticFiles(directory=STATIC_DIR), name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = static_url
+# Compiled templates are shared between workers and restarts through the bytecode cache
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+templates.env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+# Outside development the templates only change with a deploy, so skip the mtime check on every render
+templates.env.auto_reload = os.getenv("WEB_RELOAD") == "1"
+
+
+def warm_templates():
+    """Compile all templates up front so the first page view in a worker doesn't pay for it"""
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
 
 security = HTTPBasic(realm="Spasskaya Hotel Admin")
 
@@ -48,59 +154,679 @@ async def get_current_admin(credentials: HTTPBasicCredentials = Depends(security
 async def init_redis():
     global redis_client
     try:
-        redis_client = redis.Redis(host='localhost', port=6379, db=0)
+        redis_client = redis.from_url(REDIS_URL)
         await redis_client.ping()
     except Exception as e:
         print(f"Redis connection failed: {e}")
         redis_client = None
 
+WS_QUEUE_SIZE = 100
+WS_SEND_TIMEOUT = 10
+WS_HEARTBEAT_INTERVAL = 20
+WS_HEARTBEAT_MISSES = 3
+
+
+class ClientConnection:
+    """One admin socket with its own bounded outbound queue and writer task"""
+
+    def __init__(self, websocket: WebSocket, manager):
+        self.websocket = websocket
+        self.manager = manager
+        self.queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.last_seen = asyncio.get_running_loop().time()
+        self.writer_task = asyncio.create_task(self.writer())
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+
+    def enqueue(self, message: str) -> bool:
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def writer(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(message), WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.manager.evict(self, "send failed")
+
+    async def heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            if loop.time() - self.last_seen > WS_HEARTBEAT_INTERVAL * WS_HEARTBEAT_MISSES:
+                self.manager.evict(self, "heartbeat timeout")
+                return
+            self.enqueue(json.dumps({"type": "ping"}))
+
+    def touch(self):
+        self.last_seen = asyncio.get_running_loop().time()
+
+    def close(self, code=1000):
+        self.writer_task.cancel()
+        self.heartbeat_task.cancel()
+        asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+
 class ConnectionManager:
+    """Admin WebSockets of this worker; events are fanned out to every worker through Redis pub/sub"""
+
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self.listener_task = None
+        self.pending_broadcasts = set()
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket) -> ClientConnection:
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = ClientConnection(websocket, self)
+        self.active_connections[websocket] = client
+        WS_CONNECTIONS.set(len(self.active_connections))
+        return client
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        client = self.active_connections.pop(websocket, None)
+        WS_CONNECTIONS.set(len(self.active_connections))
+        if client:
+            client.writer_task.cancel()
+            client.heartbeat_task.cancel()
+
+    def evict(self, client: ClientConnection, reason: str):
+        if self.active_connections.pop(client.websocket, None):
+            WS_CONNECTIONS.set(len(self.active_connections))
+            print(f"Evicting admin WebSocket: {reason}")
+            # 1013 "try again later": on reconnect admin.js refetches the counters and replays missed appeal events
+            client.close(code=1013)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections[:]:
+    def notify(self, event: dict):
+        """Fire-and-forget broadcast for request handlers"""
+        task = asyncio.create_task(self.broadcast(event))
+        self.pending_broadcasts.add(task)
+        task.add_done_callback(self.pending_broadcasts.discard)
+
+    async def broadcast(self, event: dict):
+        if redis_client:
             try:
-                await connection.send_text(message)
-            except:
-                self.disconnect(connection)
+                await publish_admin_event(redis_client, event)
+                return
+            except Exception as e:
+                print(f"Redis publish failed, broadcasting locally: {e}")
+        self.send_local(json.dumps(event, default=str))
+
+    def send_local(self, message: str):
+        for client in list(self.active_connections.values()):
+            if not client.enqueue(message):
+                self.evict(client, "slow consumer")
+
+    async def listen(self):
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(*ADMIN_CHANNELS)
+                async for item in pubsub.listen():
+                    if item['type'] != 'message':
+                        continue
+                    data = item['data']
+                    self.send_local(data.decode() if isinstance(data, bytes) else data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis subscription lost: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def start(self):
+        if redis_client and not self.listener_task:
+            self.listener_task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.listener_task:
+            self.listener_task.cancel()
+            self.listener_task = None
+        for client in list(self.active_connections.values()):
+            self.evict(client, "shutdown")
 
 manager = ConnectionManager()
 
-@app.on_event("startup")
+# Set explicitly rather than with set_function, which is not collected in multiprocess mode
+WS_CONNECTIONS = Gauge('admin_websocket_connections', 'Admin WebSocket clients connected', multiprocess_mode='livesum')
+
+
+def _cache_default(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, asyncpg.Record):
+        return dict(value)
+    return str(value)
+
+
+def _cache_object_hook(value):
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    return value
+
+
+class DataCache:
+    """Redis cache for computed page data with stale-while-revalidate and single-flight refresh
+
+    Entries are fresh for `ttl` seconds and are then served stale for up to `stale_ttl` more while
+    one background task recomputes them. Keys embed a per-tag generation counter, so invalidating
+    a tag is a single INCR. Concurrent misses compute once per worker (shared future) and once
+    across workers (Redis lock); the others wait for the winner's result. Every stored entry gets
+    a random version, also kept under `<key>:version`, which can serve as an ETag.
+    """
+
+    LOCK_TIMEOUT_MS = 10000
+    WAIT_STEP = 0.05
+    # Deletes the lock only while it still holds our token: after LOCK_TIMEOUT_MS it may belong to another worker
+    RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self):
+        self.inflight: Dict[str, asyncio.Future] = {}
+
+    async def _key(self, tag, name):
+        generation = await redis_client.get(CACHE_GENERATION_KEY.format(tag=tag))
+        return f"cache:{tag}:{int(generation or 0)}:{name}"
+
+    async def get(self, tag, name, compute, ttl=10, stale_ttl=60):
+        entry = await self._entry(tag, name, compute, ttl, stale_ttl)
+        return entry["value"]
+
+    async def get_versioned(self, tag, name, compute, ttl=10, stale_ttl=60):
+        """(value, version) of the entry handed out; version is None when Redis is unavailable"""
+        entry = await self._entry(tag, name, compute, ttl, stale_ttl)
+        return entry["value"], entry.get("version")
+
+    async def version(self, tag, name):
+        """Version of the current entry without reading it, or None when there is none"""
+        if not redis_client:
+            return None
+        try:
+            version = await redis_client.get(f"{await self._key(tag, name)}:version")
+        except Exception as e:
+            print(f"Cache version read failed for {tag}:{name}: {e}")
+            return None
+        return version.decode() if version else None
+
+    async def _entry(self, tag, name, compute, ttl, stale_ttl):
+        if not redis_client:
+            return {"value": await compute()}
+        try:
+            key = await self._key(tag, name)
+            raw = await redis_client.get(key)
+        except Exception as e:
+            print(f"Cache read failed for {tag}:{name}: {e}")
+            return {"value": await compute()}
+
+        if raw:
+            entry = json.loads(raw, object_hook=_cache_object_hook)
+            if time.time() - entry["at"] > ttl and key not in self.inflight:
+                self._refresh_in_background(key, compute, ttl, stale_ttl)
+            return entry
+
+        return await self._compute_once(key, compute, ttl, stale_ttl)
+
+    def _refresh_in_background(self, key, compute, ttl, stale_ttl):
+        task = asyncio.create_task(self._compute_once(key, compute, ttl, stale_ttl))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _compute_once(self, key, compute, ttl, stale_ttl):
+        if key in self.inflight:
+            return await asyncio.shield(self.inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            entry = await self._compute_across_workers(key, compute, ttl, stale_ttl)
+            future.set_result(entry)
+            return entry
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self.inflight.pop(key, None)
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    async def _compute_across_workers(self, key, compute, ttl, stale_ttl):
+        lock_key = f"{key}:lock"
+        token = secrets.token_hex(8)
+        if not await redis_client.set(lock_key, token, nx=True, px=self.LOCK_TIMEOUT_MS):
+            waited = 0
+            while waited < self.LOCK_TIMEOUT_MS / 1000:
+                await asyncio.sleep(self.WAIT_STEP)
+                waited += self.WAIT_STEP
+                raw = await redis_client.get(key)
+                if raw:
+                    entry = json.loads(raw, object_hook=_cache_object_hook)
+                    if time.time() - entry["at"] <= ttl:
+                        return entry
+                if not await redis_client.exists(lock_key):
+                    break
+        try:
+            value = await compute()
+            version = secrets.token_hex(8)
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.set(
+                    key,
+                    json.dumps({"at": time.time(), "version": version, "value": value}, default=_cache_default),
+                    ex=ttl + stale_ttl
+                )
+                pipe.set(f"{key}:version", version, ex=ttl + stale_ttl)
+                await pipe.execute()
+            # Round-trip through JSON so hits and misses hand out the same shapes
+            value = json.loads(json.dumps(value, default=_cache_default), object_hook=_cache_object_hook)
+            return {"version": version, "value": value}
+        finally:
+            await redis_client.eval(self.RELEASE_LOCK, 1, lock_key, token)
+
+    async def invalidate(self, *tags):
+        if redis_client:
+            try:
+                await invalidate_cached(redis_client, *tags)
+            except Exception as e:
+                print(f"Cache invalidation failed for {tags}: {e}")
+
+
+data_cache = DataCache()
+
+
+STATS_CACHE = ("appeals", "stats")
+
+
+async def cached_stats_versioned():
+    return await data_cache.get_versioned(*STATS_CACHE, get_appeals_stats, ttl=10, stale_ttl=60)
+
+
+async def cached_stats():
+    stats, _ = await cached_stats_versioned()
+    return stats
+
+
+async def cached_appeals_page(limit):
+    async def compute():
+        rows, total = await get_appeals(limit=limit)
+        return {"appeals": [dict(row) for row in rows], "total": total}
+
+    data = await data_cache.get("appeals", f"first_page:{limit}", compute, ttl=5, stale_ttl=30)
+    return data["appeals"], data["total"]
+
+
+async def cached_admin_names() -> Dict[int, str]:
+    """Display names of admins that appeals can be assigned to, keyed by Telegram user_id"""
+    async def compute():
+        # Pairs rather than a dict: JSON would turn the integer keys into strings
+        return [[admin["user_id"], f"@{admin['username']}" if admin["username"] else str(admin["user_id"])]
+                for admin in await get_all_admins()]
+
+    return dict(await data_cache.get("admins", "names", compute, ttl=60, stale_ttl=300))
+
+
+# Changes with every deploy/restart so validators from an older build never match
+BUILD_ID = secrets.token_hex(4)
+
+
+class TableVersions:
+    """In-memory change counters of versioned tables, kept current through LISTEN/NOTIFY
+
+    While the listener connection is down the versions are unknown and every request is served in full.
+    """
+
+    def __init__(self):
+        self.versions: Dict[str, int] = {}
+        self.changed_at: Dict[str, datetime] = {}
+        self.conn = None
+        self.watch_task = None
+
+    @property
+    def ready(self):
+        return self.conn is not None and not self.conn.is_closed()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        table, _, version = payload.rpartition(":")
+        if int(version) > self.versions.get(table, 0):
+            self.versions[table] = int(version)
+            self.changed_at[table] = datetime.now(timezone.utc).replace(microsecond=0)
+
+    async def connect(self):
+        self.conn = await asyncpg.connect(DB_URL)
+        await self.conn.add_listener(TABLE_VERSIONS_CHANNEL, self._on_notify)
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        for table, version in (await get_table_versions(self.conn)).items():
+            if version != self.versions.get(table):
+                self.versions[table] = version
+                self.changed_at[table] = now
+
+    async def watch(self):
+        while True:
+            if not self.ready:
+                try:
+                    await self.connect()
+                except Exception as e:
+                    print(f"Table version listener unavailable: {e}")
+                    self.conn = None
+            await asyncio.sleep(5)
+
+    def start(self):
+        if not self.watch_task:
+            self.watch_task = asyncio.create_task(self.watch())
+
+    async def stop(self):
+        if self.watch_task:
+            self.watch_task.cancel()
+            self.watch_task = None
+        if self.ready:
+            await self.conn.close()
+
+    def validators(self, resource, tables, extra=""):
+        """(ETag, Last-Modified) for a resource derived from the given tables, or (None, None) if unknown"""
+        if not self.ready or any(table not in self.versions for table in tables):
+            return None, None
+        stamp = "-".join(str(self.versions[table]) for table in tables)
+        etag = f'W/"{resource}-{BUILD_ID}-{stamp}{extra}"'
+        return etag, max(self.changed_at[table] for table in tables)
+
+
+table_versions = TableVersions()
+
+
+_templates_cache = {"version": None, "loaded_at": 0.0, "templates": {}}
+
+
+async def cached_templates() -> Dict[str, str]:
+    """All message templates, reloaded when message_templates changes (or every 30s while versions are unknown)"""
+    version = table_versions.versions.get("message_templates") if table_versions.ready else None
+    if version is not None:
+        fresh = _templates_cache["version"] == version
+    else:
+        fresh = time.monotonic() - _templates_cache["loaded_at"] < 30
+    if not fresh or not _templates_cache["loaded_at"]:
+        rows = await get_all_message_templates()
+        _templates_cache.update(
+            version=version,
+            loaded_at=time.monotonic(),
+            templates={row["key"]: row["text"] for row in rows}
+        )
+    return _templates_cache["templates"]
+
+
+def status_notice_text(status, texts):
+    status_messages = {
+        'received': texts.get('status_received') or 'получено в работу ✅',
+        'declined': texts.get('status_declined') or 'отклонено ❌',
+        'done': texts.get('status_done') or 'выполнено ✅'
+    }
+
+    status_msg = status_messages.get(status, f"изменён на {status}")
+    message_text = f"📬 Ваше обращение {status_msg}"
+
+    if status == 'done':
+        done_full = texts.get('status_done_full')
+        if done_full:
+            message_text = done_full
+        else:
+            message_text += "\n\nЕсли проблема не решена, нажмите кнопку 'Не решено' ниже."
+    return message_text
+
+
+def validator_headers(etag, last_modified):
+    if not etag:
+        return {}
+    return {
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        "Cache-Control": "private, no-cache"
+    }
+
+
+def is_not_modified(request: Request, etag, last_modified):
+    if not etag:
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+# Last serialized body per resource, reused while its ETag is unchanged
+_json_bodies: Dict[str, tuple] = {}
+
+
+async def conditional_json(request: Request, resource, tables, produce, extra="", cache_entry=None):
+    """Serve a JSON resource with ETag/Last-Modified, answering 304 without touching the database
+
+    cache_entry=(tag, name) marks producers that read that Redis data cache entry and return
+    (value, version). The cache can lag behind the table versions, so the ETag is the entry's
+    version instead and those bodies are never memoized. Only a cache miss computes before answering.
+    """
+    if cache_entry:
+        def cache_headers(version):
+            return {"ETag": f'W/"{resource}-{BUILD_ID}-{version}"', "Cache-Control": "private, no-cache"}
+
+        version = await data_cache.version(*cache_entry)
+        if_none_match = request.headers.get("if-none-match")
+        if version and if_none_match:
+            headers = cache_headers(version)
+            if headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+                return Response(status_code=304, headers=headers)
+        value, version = await produce()
+        headers = cache_headers(version) if version else {}
+        return Response(content=dump_json(value), media_type="application/json", headers=headers)
+
+    etag, last_modified = table_versions.validators(resource, tables, extra)
+    headers = validator_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    cached = _json_bodies.get(resource)
+    if etag and cached and cached[0] == etag:
+        body = cached[1]
+    else:
+        body = dump_json(await produce())
+        if etag:
+            _json_bodies[resource] = (etag, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Request latency by route', ['method', 'route', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+HTTP_RESPONSE_BYTES = Histogram(
+    'http_response_size_bytes', 'Response body size by route', ['route'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+)
+HTTP_IN_PROGRESS = Gauge('http_requests_in_progress', 'Requests being handled', ['method'], multiprocess_mode='livesum')
+HTTP_DB_SECONDS = Histogram(
+    'http_request_db_seconds', 'Time spent in SQL statements per request', ['route'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+# Sampled profiling: PROFILE_SAMPLE_RATE of requests are sampled, and those slower than
+# PROFILE_SLOW_MS are written to PROFILE_DIR as collapsed stacks (flamegraph.pl / speedscope input)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/admin-profiles")
+
+
+class StackSampler:
+    """Samples the event loop thread's stack from a helper thread while one request runs"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = StackCounter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.stacks
+
+
+class RequestProfiler:
+    # Only one request is sampled at a time: the sampler sees the whole loop, not just one task
+    def __init__(self):
+        self.active = False
+
+    def maybe_start(self):
+        if self.active or PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+        self.active = True
+        return StackSampler(threading.get_ident()).start()
+
+    def finish(self, sampler, method, route, elapsed):
+        stacks = sampler.stop()
+        self.active = False
+        if elapsed * 1000 < PROFILE_SLOW_MS or not stacks:
+            return
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{method}_{route.strip('/').replace('/', '_') or 'root'}_{elapsed * 1000:.0f}ms.folded"
+            with open(os.path.join(PROFILE_DIR, name), "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            print(f"Slow request profile written: {name}")
+        except OSError as e:
+            print(f"Could not write request profile: {e}")
+
+
+profiler = RequestProfiler()
+
+
+# Long-lived responses: never buffered by compression and never profiled
+STREAMING_PATHS = ("/api/events",)
+
+
+class RequestMetricsMiddleware:
+    """Per-route latency, response size, in-flight requests and DB time for every HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+        size = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_IN_PROGRESS.labels(method).inc()
+        sampler = profiler.maybe_start() if scope["path"] not in STREAMING_PATHS else None
+        started = time.perf_counter()
+        route = "unmatched"
+        try:
+            async with track_unit("web") as unit:
+                try:
+                    await self.app(scope, receive, send_with_metrics)
+                finally:
+                    # The router stores the matched route in the shared scope; mounts (static) only set root_path
+                    route = getattr(scope.get("route"), "path", None) or scope.get("root_path") or "unmatched"
+                    unit.name = route
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_PROGRESS.labels(method).dec()
+            HTTP_REQUEST_SECONDS.labels(method, route, str(status)).observe(elapsed)
+            HTTP_RESPONSE_BYTES.labels(route).observe(size)
+            HTTP_DB_SECONDS.labels(route).observe(unit.seconds)
+            if sampler:
+                profiler.finish(sampler, method, route, elapsed)
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware holds streamed chunks in the compressor, which would stall Server-Sent Events"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in STREAMING_PATHS:
+            return await self.app(scope, receive, send)
+        await super().__call__(scope, receive, send)
+
+
+# HTML pages and JSON lists shrink 5-10x; added first so the metrics below record the compressed size
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024)
+app.add_middleware(RequestMetricsMiddleware)
+
+
+@app.get("/metrics")
+async def metrics(admin: str = Depends(get_current_admin)):
+    # With several workers each one only sees its own samples; the multiprocess collector merges them all
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 async def startup():
+    global bulk_resume_task
+    warm_templates()
+    await get_pool()
     await init_redis()
-    conn = await asyncpg.connect(DB_URL)
-    try:
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS pending_admin_messages (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                message TEXT NOT NULL,
-                appeal_id INTEGER,
-                sent BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        print("Table pending_admin_messages created/verified")
-    except Exception as e:
-        print(f"Error creating table: {e}")
-    finally:
-        await conn.close()
+    manager.start()
+    table_versions.start()
+    bulk_resume_task = asyncio.create_task(resume_bulk_jobs())
+
+
+async def shutdown():
+    await manager.stop()
+    await table_versions.stop()
+    # Unfinished jobs keep their committed progress and are resumed by another worker after the lease expires
+    for task in [bulk_resume_task, *bulk_tasks.values()]:
+        if task:
+            task.cancel()
+    if redis_client:
+        await redis_client.aclose()
+    await close_pool()
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Drops this worker's live gauges; its counters and histograms are kept
+        multiprocess.mark_process_dead(os.getpid())
 
 @app.get("/", response_class=HTMLResponse)
 async def dashboard(request: Request, admin: str = Depends(get_current_admin)):
-    stats = await get_appeals_stats()
-    
-    appeals, total = await get_appeals(limit=10)
+    stats, (appeals, total) = await asyncio.gather(cached_stats(), cached_appeals_page(10))
     
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
@@ -116,20 +842,26 @@ async def appeals_page(
     room: Optional[str] = None,
     search: Optional[str] = None,
     request_type: Optional[str] = None,
+    awaiting: Optional[str] = None,
     page: int = 1,
     admin: str = Depends(get_current_admin)
 ):
     limit = 20
     offset = (page - 1) * limit
     
-    appeals, total = await get_appeals(
-        status=status,
-        room=room,
-        search_query=search,
-        request_type=request_type,
-        limit=limit,
-        offset=offset
-    )
+    if page == 1 and not (status or room or search or request_type or awaiting):
+        load_appeals = cached_appeals_page(limit)
+    else:
+        load_appeals = get_appeals(
+            status=status,
+            room=room,
+            search_query=search,
+            request_type=request_type,
+            awaiting=awaiting,
+            limit=limit,
+            offset=offset
+        )
+    (appeals, total), admin_names = await asyncio.gather(load_appeals, cached_admin_names())
     
     total_pages = (total + limit - 1) // limit
     
@@ -155,12 +887,129 @@ async def appeals_page(
         "room_filter": room,
         "search_filter": search,
         "request_type_filter": request_type,
-        "request_type_options": request_type_options
+        "awaiting_filter": awaiting,
+        "request_type_options": request_type_options,
+        "admin_names": admin_names
     })
 
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+async def export_csv(rows, columns, batch_size=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the Cyrillic text as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(columns)
+    count = 0
+    async for row in rows:
+        writer.writerow(["" if row[column] is None else _export_value(row[column]) for column in columns])
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+async def export_jsonl(rows, batch_size=500):
+    lines = []
+    async for row in rows:
+        item = {key: _export_value(value) for key, value in row.items()}
+        if isinstance(item.get("messages"), str):
+            item["messages"] = json.loads(item["messages"])
+        lines.append(json.dumps(item, ensure_ascii=False))
+        if len(lines) >= batch_size:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+@app.get("/api/appeals")
+async def list_appeals(
+    status: Optional[str] = None,
+    room: Optional[str] = None,
+    search: Optional[str] = None,
+    request_type: Optional[str] = None,
+    awaiting: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0,
+    admin: str = Depends(get_current_admin)
+):
+    """Appeal list as JSON; fields=id,status,room returns only those columns"""
+    if fields:
+        columns = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+        unknown = [column for column in columns if column not in APPEAL_FIELDS]
+        if unknown or not columns:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(APPEAL_FIELDS)}"
+            )
+    else:
+        columns = APPEAL_FIELDS
+    limit = max(1, min(limit, 500))
+    offset = max(0, offset)
+
+    rows, total = await get_appeals(
+        status=status, room=room, search_query=search, request_type=request_type, awaiting=awaiting,
+        limit=limit, offset=offset, columns=columns
+    )
+    return FastJSONResponse({"appeals": rows, "total": total, "limit": limit, "offset": offset})
+
+
+@app.get("/api/appeals/export")
+async def export_appeals(
+    format: str = "csv",
+    include_messages: bool = False,
+    status: Optional[str] = None,
+    room: Optional[str] = None,
+    search: Optional[str] = None,
+    request_type: Optional[str] = None,
+    awaiting: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    admin: str = Depends(get_current_admin)
+):
+    """Stream appeals (optionally with their conversations) as CSV or JSONL without buffering the whole export"""
+    if format not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="Format must be csv or jsonl")
+
+    messages = None
+    if include_messages:
+        messages = "rows" if format == "csv" else "nested"
+
+    rows = iter_appeals_export(
+        status=status,
+        room=room,
+        search_query=search,
+        request_type=request_type,
+        created_from=date_from,
+        created_to=date_to,
+        awaiting=awaiting,
+        messages=messages
+    )
+
+    filename = f"appeals_{datetime.now().strftime('%Y%m%d_%H%M')}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    if format == "csv":
+        columns = EXPORT_APPEAL_COLUMNS + (EXPORT_MESSAGE_COLUMNS if include_messages else ())
+        return StreamingResponse(export_csv(rows, columns), media_type="text/csv; charset=utf-8", headers=headers)
+    return StreamingResponse(export_jsonl(rows), media_type="application/x-ndjson", headers=headers)
+
+
 @app.get("/appeals/{appeal_id}", response_class=HTMLResponse)
 async def appeal_detail(request: Request, appeal_id: int, admin: str = Depends(get_current_admin)):
-    appeal, messages = await get_appeal_with_messages(appeal_id)
+    (appeal, messages, has_more, message_count), admin_names = await asyncio.gather(
+        get_appeal_with_messages(appeal_id), cached_admin_names()
+    )
     
     if not appeal:
         raise HTTPException(status_code=404, detail="Appeal not found")
@@ -168,9 +1017,28 @@ async def appeal_detail(request: Request, appeal_id: int, admin: str = Depends(g
     return templates.TemplateResponse("appeal_detail.html", {
         "request": request,
         "appeal": appeal,
-        "messages": messages
+        "admin_names": admin_names,
+        "messages": messages,
+        "has_more_messages": has_more,
+        "message_count": message_count
     })
 
+@app.get("/api/appeals/{appeal_id}/messages")
+async def appeal_messages(appeal_id: int, before: int, limit: int = 50, admin: str = Depends(get_current_admin)):
+    messages, has_more = await get_messages_before(appeal_id, before, min(max(limit, 1), 200))
+    return {
+        "messages": [
+            {
+                "id": m["id"],
+                "sender": m["sender"],
+                "text": m["text"],
+                "created_at": m["created_at"].isoformat() if m["created_at"] else None
+            }
+            for m in messages
+        ],
+        "has_more": has_more
+    }
+
 @app.post("/api/appeals/{appeal_id}/status")
 async def update_appeal_status(appeal_id: int, request: Request, admin: str = Depends(get_current_admin)):
     try:
@@ -184,64 +1052,34 @@ async def update_appeal_status(appeal_id: int, request: Request, admin: str = De
         now = datetime.now().isoformat()
 
         if redis_client:
-            duplicate = await redis_client.get(key)
-            if duplicate:
+            if not await redis_client.set(key, "1", ex=5, nx=True):
                 print(f"[SKIP DUPLICATE] appeal {appeal_id} status={status} time={now}")
                 return {"skipped": True, "appeal_id": appeal_id, "status": status}
-            await redis_client.setex(key, 5, "1")
-
-        user_id = await update_status(appeal_id, status)
 
-        if user_id:
-            conn = await asyncpg.connect(DB_URL)
-            try:
-                status_messages = {
-                    'received': await get_message_template('status_received') or 'получено в работу ✅',
-                    'declined': await get_message_template('status_declined') or 'отклонено ❌',
-                    'done': await get_message_template('status_done') or 'выполнено ✅'
-                }
-
-                status_msg = status_messages.get(status, f"изменён на {status}")
-                message_text = f"📬 Ваше обращение {status_msg}"
-
-                if status == 'done':
-                    done_full = await get_message_template('status_done_full')
-                    if done_full:
-                        message_text = done_full
-                    else:
-                        message_text += "\n\nЕсли проблема не решена, нажмите кнопку 'Не решено' ниже."
-
-                existing = await conn.fetchrow(
-                    """SELECT id FROM pending_admin_messages 
-                       WHERE user_id = $1 AND message = $2 AND appeal_id = $3 
-                       AND created_at > NOW() - INTERVAL '1 minute'""",
-                    user_id, message_text, appeal_id
-                )
+        message_text = status_notice_text(status, await cached_templates())
+        changed = await change_status_and_notify(appeal_id, status, message_text)
+        user_id = changed["user_id"] if changed else None
+        await data_cache.invalidate("appeals")
 
-                if not existing:
-                    await conn.execute(
-                        """INSERT INTO pending_admin_messages (user_id, message, appeal_id) 
-                           VALUES ($1, $2, $3)""",
-                        user_id, message_text, appeal_id
-                    )
-            finally:
-                await conn.close()
+        if changed and changed["previous_status"] != status:
+            manager.notify(stats_delta_event(statuses=status_change(changed["previous_status"], status)))
 
-            await manager.broadcast(json.dumps({
+        if user_id:
+            manager.notify({
                 "type": "status_update",
                 "appeal_id": appeal_id,
                 "status": status,
                 "timestamp": now
-            }))
+            })
 
             if redis_client:
-                await redis_client.lpush("admin_actions", json.dumps({
+                await record_admin_action(redis_client, {
                     "type": "status_update",
                     "appeal_id": appeal_id,
                     "status": status,
                     "admin": admin,
                     "timestamp": now
-                }))
+                })
 
         return {"success": True, "appeal_id": appeal_id, "status": status}
 
@@ -258,16 +1096,18 @@ async def reply_to_appeal(appeal_id: int, request: Request, admin: str = Depends
         if not message:
             raise HTTPException(status_code=400, detail="Message is required")
         
-        await add_message(appeal_id, "admin", message)
+        message_id = await add_message(appeal_id, "admin", message)
+        await data_cache.invalidate("appeals")
         
-        conn = await asyncpg.connect(DB_URL)
+        # Before taking a connection: get_message_template acquires its own from the pool
+        admin_reply_prefix = await get_message_template('admin_reply_prefix') or "📢 Ответ администратора на обращение #{appeal_id}:\n\n{message}"
+        admin_message_text = admin_reply_prefix.format(appeal_id=appeal_id, message=message)
+
+        conn = await connect('reply_to_appeal')
         try:
             appeal = await conn.fetchrow("SELECT user_id FROM appeals WHERE id=$1", appeal_id)
             
             if appeal:
-                admin_reply_prefix = await get_message_template('admin_reply_prefix') or "📢 Ответ администратора на обращение #{appeal_id}:\n\n{message}"
-                admin_message_text = admin_reply_prefix.format(appeal_id=appeal_id, message=message)
-
                 await conn.execute(
                     """INSERT INTO pending_admin_messages (user_id, message, appeal_id)
                        VALUES ($1, $2, $3)""",
@@ -277,53 +1117,239 @@ async def reply_to_appeal(appeal_id: int, request: Request, admin: str = Depends
             await conn.close()
         
         if appeal:
-            await manager.broadcast(json.dumps({
+            manager.notify({
                 "type": "new_message",
                 "appeal_id": appeal_id,
+                "message_id": message_id,
                 "sender": "admin",
                 "message": message,
                 "timestamp": datetime.now().isoformat()
-            }))
+            })
         
         return {"success": True, "appeal_id": appeal_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sending reply: {str(e)}")
 
+BULK_CHUNK_SIZE = 500
+
+bulk_tasks: Dict[int, asyncio.Task] = {}
+bulk_resume_task = None
+
+
+async def run_bulk_job(job):
+    """Apply a bulk job chunk by chunk, reporting progress to the admin WebSockets"""
+    job_id = job["id"]
+    try:
+        while job and job["state"] == "running":
+            done_before = job["processed"]
+            job, previous = await run_bulk_job_chunk(job_id, BULK_CHUNK_SIZE)
+            if not job:
+                break
+            await data_cache.invalidate("appeals")
+
+            changes = {}
+            for previous_status, count in previous.items():
+                for key, value in status_change(previous_status, job["status"], count).items():
+                    changes[key] = changes.get(key, 0) + value
+            if changes:
+                manager.notify(stats_delta_event(statuses=changes))
+
+            manager.notify({
+                "type": "bulk_update",
+                "appeal_ids": job["appeal_ids"][done_before:job["processed"]],
+                "status": job["status"],
+                "timestamp": datetime.now().isoformat()
+            })
+            manager.notify({
+                "type": "bulk_progress",
+                "job_id": job_id,
+                "status": job["status"],
+                "processed": job["processed"],
+                "total": job["total"],
+                "state": job["state"]
+            })
+    except Exception as e:
+        print(f"Bulk job {job_id} failed: {e}")
+        await fail_bulk_job(job_id, str(e))
+        manager.notify({"type": "bulk_progress", "job_id": job_id, "state": "failed", "error": str(e)})
+    finally:
+        bulk_tasks.pop(job_id, None)
+
+
+def start_bulk_job(job):
+    if job["id"] not in bulk_tasks:
+        bulk_tasks[job["id"]] = asyncio.create_task(run_bulk_job(job))
+
+
+async def resume_bulk_jobs(interval=30):
+    """Pick up jobs left running by a stopped or crashed worker once their lease has expired"""
+    while True:
+        try:
+            for job in await claim_bulk_jobs():
+                print(f"Resuming bulk job {job['id']} at {job['processed']}/{job['total']}")
+                start_bulk_job(job)
+        except Exception as e:
+            print(f"Error resuming bulk jobs: {e}")
+        await asyncio.sleep(interval)
+
+
 @app.post("/api/appeals/bulk_update")
-async def bulk_update_appeals(appeal_ids: List[int], status: str, admin: str = Depends(get_current_admin)):
-    await bulk_update_status(appeal_ids, status)
-    
-    await manager.broadcast(json.dumps({
-        "type": "bulk_update",
-        "appeal_ids": appeal_ids,
-        "status": status,
-        "timestamp": datetime.now().isoformat()
-    }))
-    
-    return {"success": True, "updated_count": len(appeal_ids)}
+async def bulk_update_appeals(
+    appeal_ids: List[int] = Body(..., embed=True),
+    status: str = Body(..., embed=True),
+    admin: str = Depends(get_current_admin)
+):
+    appeal_ids = list(dict.fromkeys(appeal_ids))
+    if not appeal_ids:
+        raise HTTPException(status_code=400, detail="No appeals selected")
+
+    message_text = status_notice_text(status, await cached_templates())
+    job = await create_bulk_job(appeal_ids, status, message_text, admin)
+    for claimed in await claim_bulk_jobs(job["id"]):
+        start_bulk_job(claimed)
+
+    if redis_client:
+        await record_admin_action(redis_client, {
+            "type": "bulk_update",
+            "job_id": job["id"],
+            "count": len(appeal_ids),
+            "status": status,
+            "admin": admin,
+            "timestamp": datetime.now().isoformat()
+        })
+
+    return {"success": True, "job_id": job["id"], "total": job["total"], "updated_count": job["total"]}
+
+
+@app.get("/api/appeals/bulk_update/{job_id}")
+async def bulk_update_progress(job_id: int, admin: str = Depends(get_current_admin)):
+    job = await get_bulk_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "processed": job["processed"],
+        "total": job["total"],
+        "state": job["state"],
+        "error": job["error"]
+    }
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    client = await manager.connect(websocket)
     try:
         while True:
-            data = await websocket.receive_text()
-            print(f"Received: {data}")
-    except WebSocketDisconnect:
+            await websocket.receive_text()
+            client.touch()
+    except (WebSocketDisconnect, RuntimeError):
         manager.disconnect(websocket)
 
+SSE_MAX_CLIENTS = 50
+SSE_BLOCK_MS = 15000
+SSE_BATCH = 200
+SSE_RETRY_MS = 3000
+
+sse_clients = 0
+
+SSE_CONNECTIONS = Gauge('admin_sse_connections', 'Server-Sent Events clients connected', multiprocess_mode='livesum')
+
+
+def _stream_id(value):
+    ms, _, seq = value.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def sse_frame(entry_id, event):
+    return f"id: {entry_id}\nevent: {event['type']}\ndata: ".encode() + dump_json(event) + b"\n\n"
+
+
+async def appeal_event_stream(last_id, follow):
+    """Replay the event log after last_id, then wait for new entries (follow) or stop once caught up
+
+    Without last_id the stream starts at the current end of the log with a "head" event carrying
+    its id. If entries after last_id were already trimmed, a "reset" event tells the client to
+    reload its state instead.
+    """
+    global sse_clients
+    sse_clients += 1
+    SSE_CONNECTIONS.inc()
+    try:
+        yield f"retry: {SSE_RETRY_MS}\n\n".encode()
+        head = await redis_client.xrevrange(APPEAL_EVENTS_STREAM, count=1)
+        head_id = head[0][0].decode() if head else "0-0"
+        if last_id:
+            first = await redis_client.xrange(APPEAL_EVENTS_STREAM, count=1)
+            try:
+                position = _stream_id(last_id)
+                # Older than the oldest entry kept, or newer than the log itself (Redis was reset)
+                lost = bool(first) and position < _stream_id(first[0][0].decode()) or position > _stream_id(head_id)
+            except ValueError:
+                lost = True
+            if lost:
+                yield sse_frame(head_id, {"type": "reset", "event_id": head_id})
+                last_id = head_id
+        else:
+            yield sse_frame(head_id, {"type": "head", "event_id": head_id})
+            last_id = head_id
+
+        while True:
+            response = await redis_client.xread(
+                {APPEAL_EVENTS_STREAM: last_id}, count=SSE_BATCH, block=SSE_BLOCK_MS if follow else None
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                if not follow:
+                    return
+                yield b": ping\n\n"
+                continue
+            frames = []
+            for entry_id, fields in entries:
+                last_id = entry_id.decode()
+                event = json.loads(fields[b"data"])
+                event["event_id"] = last_id
+                frames.append(sse_frame(last_id, event))
+            yield b"".join(frames)
+    finally:
+        sse_clients -= 1
+        SSE_CONNECTIONS.dec()
+
+
+@app.get("/api/events")
+async def appeal_events(
+    request: Request,
+    last_event_id: Optional[str] = None,
+    follow: bool = True,
+    admin: str = Depends(get_current_admin)
+):
+    """Appeal lifecycle events (new_appeal, status_update, new_message, bulk_update) as Server-Sent Events
+
+    Browsers resume through the Last-Event-ID header; ?last_event_id= does the same for clients
+    that cannot set headers, and follow=false returns only the missed events.
+    """
+    if not redis_client:
+        raise HTTPException(status_code=503, detail="Event log unavailable")
+    if sse_clients >= SSE_MAX_CLIENTS:
+        raise HTTPException(status_code=503, detail="Too many event stream clients", headers={"Retry-After": "30"})
+    return StreamingResponse(
+        appeal_event_stream(request.headers.get("last-event-id") or last_event_id, follow),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/test-js", response_class=HTMLResponse)
 async def test_js_page(request: Request, admin: str = Depends(get_current_admin)):
     from fastapi.responses import FileResponse
     return FileResponse("web/test_js.html")
 
 @app.get("/api/stats")
-async def get_stats(admin: str = Depends(get_current_admin)):
-    return await get_appeals_stats()
+async def get_stats(request: Request, admin: str = Depends(get_current_admin)):
+    return await conditional_json(request, "stats", ("appeals",), cached_stats_versioned, cache_entry=STATS_CACHE)
 
 @app.get("/analytics", response_class=HTMLResponse)
 async def analytics_page(request: Request, admin: str = Depends(get_current_admin)):
-    stats = await get_appeals_stats()
+    stats = await cached_stats()
     
     return templates.TemplateResponse("analytics.html", {
         "request": request,
@@ -347,17 +1373,25 @@ async def appeals_by_type_page(request: Request, admin: str = Depends(get_curren
 
 @app.get("/notifications", response_class=HTMLResponse)
 async def notifications_page(request: Request, admin: str = Depends(get_current_admin)):
+    etag, last_modified = table_versions.validators("notifications-page", ("notification_settings",))
+    headers = validator_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
     recipients = await get_notification_recipients(active_only=False)
     
     return templates.TemplateResponse("notifications.html", {
         "request": request,
         "recipients": recipients
-    })
+    }, headers=headers)
 
 @app.get("/api/notification-recipients")
-async def get_recipients(admin: str = Depends(get_current_admin)):
-    recipients = await get_notification_recipients(active_only=False)
-    return {"recipients": [dict(r) for r in recipients]}
+async def get_recipients(request: Request, admin: str = Depends(get_current_admin)):
+    async def produce():
+        recipients = await get_notification_recipients(active_only=False)
+        return {"recipients": recipients}
+
+    return await conditional_json(request, "notification-recipients", ("notification_settings",), produce)
 
 @app.post("/api/notification-recipients")
 async def add_recipient(request: Request, admin: str = Depends(get_current_admin)):
@@ -400,16 +1434,24 @@ async def toggle_recipient(chat_id: int, request: Request, admin: str = Depends(
 
 @app.get("/messages", response_class=HTMLResponse)
 async def messages_page(request: Request, admin: str = Depends(get_current_admin)):
+    etag, last_modified = table_versions.validators("messages-page", ("message_templates",))
+    headers = validator_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
     templates_data = await get_all_message_templates()
     return templates.TemplateResponse("messages.html", {
         "request": request,
         "templates": templates_data
-    })
+    }, headers=headers)
 
 @app.get("/api/messages")
-async def get_messages(admin: str = Depends(get_current_admin)):
-    templates_data = await get_all_message_templates()
-    return {"templates": [dict(t) for t in templates_data]}
+async def get_messages(request: Request, admin: str = Depends(get_current_admin)):
+    async def produce():
+        templates_data = await get_all_message_templates()
+        return {"templates": templates_data}
+
+    return await conditional_json(request, "messages", ("message_templates",), produce)
 
 @app.post("/api/messages/{template_key}")
 async def update_message(template_key: str, request: Request, admin: str = Depends(get_current_admin)):
@@ -436,16 +1478,24 @@ async def get_quick_reply(request_type: str, admin: str = Depends(get_current_ad
 
 @app.get("/settings", response_class=HTMLResponse)
 async def settings_page(request: Request, admin: str = Depends(get_current_admin)):
+    etag, last_modified = table_versions.validators("settings-page", ("settings",))
+    headers = validator_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
     settings_data = await get_all_settings()
     return templates.TemplateResponse("settings.html", {
         "request": request,
         "settings": settings_data
-    })
+    }, headers=headers)
 
 @app.get("/api/settings")
-async def get_settings(admin: str = Depends(get_current_admin)):
-    settings_data = await get_all_settings()
-    return {"settings": [dict(s) for s in settings_data]}
+async def get_settings(request: Request, admin: str = Depends(get_current_admin)):
+    async def produce():
+        settings_data = await get_all_settings()
+        return {"settings": settings_data}
+
+    return await conditional_json(request, "settings", ("settings",), produce)
 
 @app.post("/api/settings/{setting_key}")
 async def update_setting_endpoint(setting_key: str, request: Request, admin: str = Depends(get_current_admin)):
@@ -463,4 +1513,21 @@ async def update_setting_endpoint(setting_key: str, request: Request, admin: str
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    # Each worker is a separate process with its own pool and Redis client; shared state lives in Postgres/Redis.
+    # WEB_RELOAD=1 runs a single auto-reloading process for development.
+    reload = os.getenv("WEB_RELOAD") == "1"
+    if not reload and WEB_WORKERS > 1:
+        # Workers inherit this before importing prometheus_client, so /metrics can aggregate all of them
+        metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus-"))
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            if name.endswith(".db"):
+                os.remove(os.path.join(metrics_dir, name))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("WEB_PORT", "8000")),
+        workers=1 if reload else WEB_WORKERS,
+        reload=reload,
+        proxy_headers=True
+    )
\ No newline at end of file
@@ -3,24 +3,192 @@ window.ADMIN_JS_VERSION = '3.1';
 
 class AdminPanel {
     constructor() {
+        this.socket = null;
+        this.reconnectDelay = 1000;
+        this.lastEventId = null;
+        this.statsSyncing = false;
+        this.catchingUp = false;
+        this.bufferedEvents = [];
         this.init();
     }
     
     init() {
         this.setupEventListeners();
         this.updateTimestamps();
-        this.updateConnectionStatus();
+        this.connectWebSocket();
         
         setInterval(() => this.updateTimestamps(), 60000);
         
-        console.log('AdminPanel initialized (no WebSocket)');
+        console.log('AdminPanel initialized');
     }
     
-    updateConnectionStatus() {
-        const statusElement = document.getElementById('websocketStatus');
+    updateConnectionStatus(connected) {
+        const statusElement = document.getElementById('websocketStatus') || document.getElementById('statusIndicator');
         if (statusElement) {
-            statusElement.className = 'badge bg-success';
-            statusElement.innerHTML = '<i class="fas fa-check-circle"></i> Готов';
+            statusElement.className = `badge bg-${connected ? 'success' : 'secondary'}`;
+            statusElement.innerHTML = connected
+                ? '<i class="fas fa-check-circle"></i> Онлайн'
+                : '<i class="fas fa-plug"></i> Переподключение...';
+        }
+    }
+    
+    connectWebSocket() {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        this.socket = new WebSocket(`${protocol}//${window.location.host}/ws`);
+        
+        this.socket.addEventListener('open', () => {
+            this.reconnectDelay = 1000;
+            this.updateConnectionStatus(true);
+            this.refreshStats();
+            this.catchUp();
+        });
+        
+        this.socket.addEventListener('message', (e) => {
+            try {
+                const event = JSON.parse(e.data);
+                // Logged events wait for the catch-up, otherwise they would move lastEventId past the missed ones
+                if (this.catchingUp && event.event_id) {
+                    this.bufferedEvents.push(event);
+                } else {
+                    this.handleEvent(event);
+                }
+            } catch (error) {
+                console.error('WebSocket message error:', error);
+            }
+        });
+        
+        this.socket.addEventListener('close', () => {
+            this.updateConnectionStatus(false);
+            setTimeout(() => this.connectWebSocket(), this.reconnectDelay);
+            this.reconnectDelay = Math.min(this.reconnectDelay * 2, 30000);
+        });
+    }
+    
+    // Replays appeal events missed while the socket was down; on the first connect it only learns the current position
+    async catchUp() {
+        const query = this.lastEventId ? `last_event_id=${encodeURIComponent(this.lastEventId)}&` : '';
+        this.catchingUp = true;
+        try {
+            const response = await fetch(`/api/events?${query}follow=false`);
+            if (!response.ok) return;
+            const text = await response.text();
+            text.split('\n\n').forEach(block => {
+                const line = block.split('\n').find(l => l.startsWith('data: '));
+                if (line) this.handleEvent(JSON.parse(line.slice(6)));
+            });
+        } catch (error) {
+            console.error('Event catch-up failed:', error);
+        } finally {
+            this.catchingUp = false;
+            const buffered = this.bufferedEvents.sort((a, b) => this.compareEventIds(a.event_id, b.event_id));
+            this.bufferedEvents = [];
+            buffered.forEach(event => this.handleEvent(event));
+        }
+    }
+
+    compareEventIds(a, b) {
+        const [aMs, aSeq] = a.split('-').map(Number);
+        const [bMs, bSeq] = b.split('-').map(Number);
+        return aMs - bMs || aSeq - bSeq;
+    }
+
+    handleEvent(event) {
+        if (event.type === 'ping') {
+            if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+                this.socket.send('pong');
+            }
+            return;
+        }
+
+        if (event.type === 'reset') {
+            this.lastEventId = event.event_id;
+            this.showToast('Часть обновлений пропущена, обновите страницу', 'warning');
+            return;
+        }
+
+        // Events arrive both live and through catch-up; handle each one once
+        if (event.event_id) {
+            if (this.lastEventId && this.compareEventIds(event.event_id, this.lastEventId) <= 0) return;
+            this.lastEventId = event.event_id;
+        }
+        if (event.type === 'head') return;
+
+        document.dispatchEvent(new CustomEvent(`admin:${event.type}`, { detail: event }));
+        
+        switch (event.type) {
+            case 'status_update':
+                this.updateAppealStatusInTable(event.appeal_id, event.status);
+                break;
+            case 'bulk_update':
+                (event.appeal_ids || []).forEach(id => this.updateAppealStatusInTable(id, event.status));
+                break;
+            case 'new_appeal':
+                this.showToast(`Новая заявка #${event.appeal_id} (комната ${event.room})` +
+                    (event.assigned_admin_name ? `, ответственный ${event.assigned_admin_name}` : ''), 'warning');
+                this.showBrowserNotification(`Новая заявка #${event.appeal_id}`, event.text || '');
+                break;
+            case 'new_message':
+                if (event.sender === 'user') {
+                    this.showToast(`Новое сообщение по обращению #${event.appeal_id}`, 'info');
+                }
+                break;
+            case 'sla_breach':
+                this.showToast(`Заявка #${event.appeal_id} (комната ${event.room}) ждёт ${event.waited_minutes} мин`, 'danger');
+                this.showBrowserNotification(`Просрочена заявка #${event.appeal_id}`, `Комната ${event.room}`);
+                break;
+            case 'stats_delta':
+                this.applyStatsDelta(event.delta || {});
+                break;
+        }
+    }
+    
+    // Deltas are not replayed, so counters are reset from /api/stats on every (re)connect;
+    // deltas arriving meanwhile are already part of the snapshot and are skipped
+    async refreshStats() {
+        if (!document.querySelector('[data-stat]')) return;
+        this.statsSyncing = true;
+        try {
+            const response = await fetch('/api/stats');
+            if (!response.ok) return;
+            const stats = await response.json();
+            const values = {};
+            ['total', 'new', 'received', 'done', 'declined', 'today_count'].forEach(key => {
+                values[key] = stats[key];
+            });
+            (stats.types || []).forEach(item => {
+                values[`type:${item.type}`] = item.count;
+            });
+            Object.entries(values).forEach(([key, value]) => {
+                document.querySelectorAll(`[data-stat="${key}"]`).forEach(element => {
+                    element.textContent = value ?? 0;
+                });
+            });
+        } catch (error) {
+            console.error('Stats refresh failed:', error);
+        } finally {
+            this.statsSyncing = false;
+        }
+    }
+
+    applyStatsDelta(delta) {
+        if (this.statsSyncing) return;
+        const changes = Object.assign({}, delta.statuses || {});
+        if (delta.total) changes.total = delta.total;
+        if (delta.today_count) changes.today_count = delta.today_count;
+        Object.entries(delta.types || {}).forEach(([type, value]) => {
+            changes[`type:${type}`] = value;
+        });
+        
+        Object.entries(changes).forEach(([key, value]) => {
+            document.querySelectorAll(`[data-stat="${key}"]`).forEach(element => {
+                element.textContent = (parseInt(element.textContent, 10) || 0) + value;
+            });
+        });
+    }
+    
+    showBrowserNotification(title, body) {
+        if ('Notification' in window && Notification.permission === 'granted' && document.hidden) {
+            new Notification(title, { body });
         }
     }
     